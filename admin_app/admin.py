@@ -1,10 +1,14 @@
 from django import forms
 from django.contrib import admin
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Substr
 from .models import CompanyInfo, Product, BlogPost, Request, Review
-import os
+from .changelist import DateRangeQuerySet, EstimatedCountPaginator
 import json
-from django.conf import settings
 from django.forms.widgets import Widget
+from storage import MAX_UPLOAD_SIZE, save_chunks
+from models import SEARCH_CONFIG
 
 
 class MultipleFileInput(forms.FileInput):
@@ -26,9 +30,70 @@ class MultipleFileField(forms.FileField):
             result = [single_file_clean(d, initial) for d in data]
         else:
             result = single_file_clean(data, initial)
+
+        files = result if isinstance(result, list) else [result]
+        for file in files:
+            if file and file.size > MAX_UPLOAD_SIZE:
+                raise forms.ValidationError(
+                    f'Файл {file.name} больше {MAX_UPLOAD_SIZE // (1024 * 1024)} МБ'
+                )
         return result
 
 
+# Поиск в админке по GIN-индексу на search_vector (колонку ведет Postgres, см. models.py API)
+# вместо ILIKE '%...%' по search_fields
+class FullTextSearchMixin:
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        table = self.model._meta.db_table
+        match = RawSQL(
+            f"{table}.search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', %s)",
+            (search_term,),
+            output_field=BooleanField(),
+        )
+        return queryset.filter(match), False
+
+
+# Changelist для больших таблиц: оценка числа строк вместо COUNT(*), без второго
+# COUNT(*) по всей таблице ("показать все") и date_hierarchy без DISTINCT по датам
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = DateRangeQuerySet(self.model, using=self.model._default_manager.db)
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+
+# Превью длинного текста считается в SQL (SUBSTRING), а сама колонка не загружается:
+# preview_fields = {'comment_preview': ('comment', 50)}
+class TextPreviewMixin:
+    preview_fields = {}
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = request.resolver_match
+        if not self.preview_fields or match is None or not match.url_name.endswith('_changelist'):
+            return queryset
+        annotations = {
+            name: Substr(field, 1, length + 1) for name, (field, length) in self.preview_fields.items()
+        }
+        deferred = [field for field, _ in self.preview_fields.values()]
+        return queryset.annotate(**annotations).defer(*deferred)
+
+    def preview(self, obj, name):
+        field, length = self.preview_fields[name]
+        text = getattr(obj, name, None)
+        if text is None:
+            text = getattr(obj, field) or ''
+        return text[:length] + '...' if len(text) > length else text
+
+
 # Форма для информации о компании с отдельными полями для соцсетей
 class CompanyInfoForm(forms.ModelForm):
     # Отдельные поля для социальных сетей
@@ -258,16 +323,10 @@ class ProductForm(forms.ModelForm):
             
             for file in files_to_process:
                 if file:  # Проверяем, что файл не пустой
-                    filename = file.name
-                    save_path = os.path.join(settings.MEDIA_ROOT, filename)
-                    
-                    # Создаем директорию если не существует
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                    
-                    with open(save_path, 'wb+') as dest:
-                        for chunk in file.chunks():
-                            dest.write(chunk)
-                    image_paths.append(f"/uploads/{filename}")
+                    # Файл сохраняется под хэшем содержимого, одинаковые картинки не дублируются
+                    path = save_chunks(file.chunks(), file.name)
+                    if path not in image_paths:
+                        image_paths.append(path)
 
             instance.images = image_paths
 
@@ -277,7 +336,7 @@ class ProductForm(forms.ModelForm):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
     form = ProductForm
 
     list_display = ['title', 'price_retail', 'price_wholesale', 'price_bulk', 'region', 'guarantee']
@@ -341,16 +400,10 @@ class BlogPostForm(forms.ModelForm):
             
             for file in files_to_process:
                 if file:  # Проверяем, что файл не пустой
-                    filename = file.name
-                    save_path = os.path.join(settings.MEDIA_ROOT, filename)
-                    
-                    # Создаем директорию если не существует
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                    
-                    with open(save_path, 'wb+') as dest:
-                        for chunk in file.chunks():
-                            dest.write(chunk)
-                    image_paths.append(f"{settings.MEDIA_URL}{filename}")
+                    # Файл сохраняется под хэшем содержимого, одинаковые картинки не дублируются
+                    path = save_chunks(file.chunks(), file.name)
+                    if path not in image_paths:
+                        image_paths.append(path)
 
             instance.images = image_paths
 
@@ -360,10 +413,11 @@ class BlogPostForm(forms.ModelForm):
 
 
 @admin.register(BlogPost)
-class BlogPostAdmin(admin.ModelAdmin):
+class BlogPostAdmin(TextPreviewMixin, FullTextSearchMixin, admin.ModelAdmin):
     form = BlogPostForm
 
     list_display = ['title', 'content_preview']
+    preview_fields = {'content_preview': ('content', 100)}
     search_fields = ['title', 'content']
 
     fieldsets = (
@@ -373,21 +427,24 @@ class BlogPostAdmin(admin.ModelAdmin):
     )
 
     def content_preview(self, obj):
-        return obj.content[:100] + '...' if len(obj.content) > 100 else obj.content
+        return self.preview(obj, 'content_preview')
     content_preview.short_description = 'Превью контента'
 
     readonly_fields = ['images']
 
 
 @admin.register(Request)
-class RequestAdmin(admin.ModelAdmin):
-    list_display = ['name', 'phone', 'comment_preview']
-    list_filter = ['name']
+class RequestAdmin(TextPreviewMixin, LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ['name', 'phone', 'comment_preview', 'created_at']
+    # Фильтр по имени строил DISTINCT по всем заявкам; дата идет по индексу ix_requests_created_at
+    date_hierarchy = 'created_at'
+    ordering = ['-id']
     search_fields = ['name', 'phone']
-    readonly_fields = ['name', 'phone', 'comment']
+    readonly_fields = ['name', 'phone', 'comment', 'created_at']
+    preview_fields = {'comment_preview': ('comment', 50)}
     
     def comment_preview(self, obj):
-        return obj.comment[:50] + '...' if len(obj.comment) > 50 else obj.comment
+        return self.preview(obj, 'comment_preview')
     comment_preview.short_description = 'Комментарий'
     
     def has_add_permission(self, request):
@@ -395,14 +452,18 @@ class RequestAdmin(admin.ModelAdmin):
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(TextPreviewMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'review_preview', 'created_at']
     list_filter = ['created_at']
+    date_hierarchy = 'created_at'
+    # Сортировка совпадает с индексом ix_reviews_created_at_id (обратный обход)
+    ordering = ['-created_at', '-id']
     search_fields = ['name', 'review']
     readonly_fields = ['created_at']
+    preview_fields = {'review_preview': ('review', 50)}
     
     def review_preview(self, obj):
-        return obj.review[:50] + '...' if len(obj.review) > 50 else obj.review
+        return self.preview(obj, 'review_preview')
     review_preview.short_description = 'Отзыв'
 
 
@@ -0,0 +1,105 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+COUNT_THRESHOLD = getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
+
+
+# Пагинатор для больших таблиц: точный COUNT(*) только пока строк немного.
+# Без фильтров число строк берется из статистики планировщика (pg_class.reltuples).
+# С фильтрами сначала считаем не больше threshold + 1 строк (COUNT по подзапросу с LIMIT
+# останавливается рано), и только если их больше - берем оценку EXPLAIN.
+class EstimatedCountPaginator(Paginator):
+    threshold = COUNT_THRESHOLD
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+
+        if not queryset.query.where:
+            estimate = self._table_estimate(queryset)
+            if estimate is None or estimate < self.threshold:
+                return super().count
+            return estimate
+
+        bounded = queryset.order_by().values('pk')[:self.threshold + 1].count()
+        if bounded <= self.threshold:
+            return bounded
+        estimate = self._plan_estimate(queryset)
+        return max(estimate or 0, bounded)
+
+    def _table_estimate(self, queryset):
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # -1: таблица еще ни разу не анализировалась
+        if row is None or row[0] < 0:
+            return None
+        return row[0]
+
+    def _plan_estimate(self, queryset):
+        plan = queryset.order_by().explain(format='json')
+        try:
+            return int(json.loads(plan)[0]['Plan']['Plan Rows'])
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+
+
+def _next_period(value, kind):
+    if kind == 'year':
+        return value.replace(year=value.year + 1)
+    if kind == 'month':
+        return value.replace(year=value.year + value.month // 12, month=value.month % 12 + 1)
+    return value + datetime.timedelta(days=1)
+
+
+def _truncate(value, kind):
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0) if isinstance(value, datetime.datetime) else value
+    if kind == 'year':
+        return value.replace(month=1, day=1)
+    if kind == 'month':
+        return value.replace(day=1)
+    return value
+
+
+# QuerySet для date_hierarchy: стандартный dates()/datetimes() делает
+# SELECT DISTINCT date_trunc(...) по всем строкам. Здесь периоды перечисляются между
+# MIN и MAX (два обхода индекса по дате); период без строк просто даст пустую страницу.
+class DateRangeQuerySet(QuerySet):
+    def _period_range(self, field_name, kind, tzinfo=None):
+        bounds = self.order_by().aggregate(first=Min(field_name), last=Max(field_name))
+        first, last = bounds['first'], bounds['last']
+        if first is None:
+            return []
+        if settings.USE_TZ and isinstance(first, datetime.datetime) and timezone.is_aware(first):
+            # Периоды в часовом поясе админки, как у стандартного datetimes()
+            first, last = timezone.localtime(first, tzinfo), timezone.localtime(last, tzinfo)
+        periods = []
+        current = _truncate(first, kind)
+        while current <= last:
+            periods.append(current)
+            current = _next_period(current, kind)
+        return periods
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, is_dst=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        periods = self._period_range(field_name, kind, tzinfo)
+        return sorted(periods, reverse=order == 'DESC')
+
+    def dates(self, field_name, kind, order='ASC'):
+        if kind not in ('year', 'month', 'day'):
+            return super().dates(field_name, kind, order)
+        periods = self._period_range(field_name, kind)
+        return sorted(periods, reverse=order == 'DESC')
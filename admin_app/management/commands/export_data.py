@@ -0,0 +1,53 @@
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from admin_app.models import Product, Request, Review
+from exporting import EXPORT_BATCH_SIZE, EXPORT_FIELDS, ExportEncoder
+
+EXPORT_MODELS = {'products': Product, 'requests': Request, 'reviews': Review}
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка товаров, заявок или отзывов в NDJSON/CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(EXPORT_MODELS))
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--since', help='ISO дата/время, только для requests и reviews')
+        parser.add_argument('--output', '-o', default='-', help='Файл или "-" для stdout')
+
+    def handle(self, *args, **options):
+        table = options['table']
+        model = EXPORT_MODELS[table]
+        fields = EXPORT_FIELDS[table]
+        queryset = model.objects.order_by('id').values_list(*fields)
+
+        if options['since']:
+            if 'created_at' not in fields:
+                raise CommandError(f'Table {table} has no created_at')
+            try:
+                since = datetime.datetime.fromisoformat(options['since'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, datetime.timezone.utc)
+            queryset = queryset.filter(created_at__gte=since)
+
+        encoder = ExportEncoder(options['format'], fields, compress=options['gzip'])
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        with output:
+            output.write(encoder.header())
+            # iterator() на Postgres читает через серверный курсор пачками по chunk_size
+            batch = []
+            for row in queryset.iterator(chunk_size=EXPORT_BATCH_SIZE):
+                batch.append(row)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    output.write(encoder.encode(batch))
+                    batch = []
+            if batch:
+                output.write(encoder.encode(batch))
+            output.write(encoder.finish())
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from image_gc import SHARDS, image_gc
+
+
+# Ссылки на файлы для image_gc.ImageGC через соединение Django
+class DjangoImageRefStore:
+    def referenced(self, paths):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT path FROM image_refs WHERE path = ANY(%s)', [list(paths)])
+            return {row[0] for row in cursor.fetchall()}
+
+    def orphans(self, limit):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT path, released_at FROM image_orphans ORDER BY released_at LIMIT %s', [limit])
+            rows = cursor.fetchall()
+        return [row[0] for row in rows], (rows[-1][1] if rows else None)
+
+    def forget_orphans(self, paths, released_until):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM image_orphans WHERE path = ANY(%s) AND released_at <= %s',
+                [list(paths), released_until],
+            )
+
+
+class Command(BaseCommand):
+    help = 'Перенос неиспользуемых загрузок в карантин и удаление просроченных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=None,
+                            help='Сколько каталогов uploads/xx/ просмотреть за проход')
+        parser.add_argument('--full', action='store_true',
+                            help='Просмотреть все каталоги, даже не менявшиеся с прошлого прохода')
+        parser.add_argument('--dry-run', action='store_true', help='Только отчет, без переноса и удаления')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('image_refs')")
+            if cursor.fetchone()[0] is None:
+                raise CommandError('Table image_refs does not exist: start the API once to create the schema')
+
+        shards = options['shards']
+        if options['full'] and shards is None:
+            shards = len(SHARDS)
+        report = image_gc.run(
+            DjangoImageRefStore(), full=options['full'], shards_per_run=shards, dry_run=options['dry_run'],
+        )
+        if report is None:
+            raise CommandError('Image GC is already running in another process')
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(
+            f"{prefix}orphans checked {report['orphans_checked']}, shards scanned {report['shards_scanned']} "
+            f"({report['files_scanned']} files, {report['skipped_young']} within grace period)"
+        )
+        self.stdout.write(
+            f"{prefix}quarantined {report['quarantined']} files ({report['quarantined_bytes']} bytes), "
+            f"restored {report['restored']}"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}deleted {report['deleted']} files, reclaimed {report['reclaimed_bytes']} bytes; "
+            f"in quarantine {report['quarantine_files']} files ({report['quarantine_bytes']} bytes), "
+            f"{report['seconds']:.2f}s"
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import OperationalError
+
+
+class Command(BaseCommand):
+    help = 'Ждет готовности базы данных (вместо фиксированного sleep при старте контейнера)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=60, help='Секунд ожидания')
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options['timeout']
+        delay = 0.1
+        connection = connections['default']
+        while True:
+            try:
+                connection.ensure_connection()
+                break
+            except OperationalError as e:
+                if time.monotonic() + delay > deadline:
+                    raise CommandError(f'Database is not available: {e}')
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+        self.stdout.write('Database is ready')
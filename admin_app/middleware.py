@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connection, connections
+
+from slow_queries import SlowQueryLog
+
+admin_slow_query_log = SlowQueryLog('admin')
+
+# EXPLAIN выполняется в отдельном потоке (со своим соединением Django), чтобы не
+# задерживать ответ админки
+_explain_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _explain(normalized, sql, params):
+    # Поток живет дольше запросов, поэтому соединение обслуживается как в начале и конце
+    # запроса Django: сломанное (например, после перезапуска БД) или устаревшее по
+    # CONN_MAX_AGE закрывается и открывается заново
+    close_old_connections()
+    try:
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+    except Exception as e:
+        plan = f'EXPLAIN failed: {e}'
+    finally:
+        close_old_connections()
+    admin_slow_query_log.set_explain(normalized, plan)
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with connection.execute_wrapper(self._wrapper(request)):
+            return self.get_response(request)
+
+    def _wrapper(self, request):
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = time.perf_counter() - started
+                if duration >= admin_slow_query_log.threshold:
+                    match = request.resolver_match
+                    view = match.view_name if match else None
+                    source = f'{request.method} {request.path}' + (f' ({view})' if view else '')
+                    normalized = admin_slow_query_log.record(sql, params, duration, source)
+                    if normalized is not None and not many:
+                        _explain_executor.submit(_explain, normalized, sql, params)
+        return wrapper
@@ -0,0 +1,10 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from admin_app.middleware import admin_slow_query_log
+
+
+# Top-N медленных запросов админки (для API - GET /debug/slow-queries)
+@staff_member_required
+def slow_queries(request):
+    return JsonResponse(admin_slow_query_log.top(), json_dumps_params={'ensure_ascii': False})
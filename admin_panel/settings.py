@@ -6,7 +6,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = 'django-insecure-your-secret-key-here'
 
-DEBUG = True
+# В продакшен-режиме (gunicorn_admin.conf.py) DJANGO_DEBUG=0
+DEBUG = os.getenv('DJANGO_DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = ['*']
 
@@ -28,6 +29,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'admin_app.middleware.SlowQueryMiddleware',
 ]
 
 ROOT_URLCONF = 'admin_panel.urls'
@@ -59,6 +61,9 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', '1234'),
         'HOST': os.getenv('DB_HOST', 'db'),
         'PORT': '5432',
+        # Постоянное соединение на воркер вместо нового на каждый запрос
+        'CONN_MAX_AGE': int(os.getenv('DJANGO_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -87,6 +92,13 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/uploads/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
+MEDIA_ROOT = os.getenv('UPLOAD_DIR', os.path.join(BASE_DIR, 'uploads'))
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+# Выше этого числа строк changelist админки показывает оценку вместо точного COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '10000'))
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Без DEBUG статику админки (./static, collectstatic) отдает сам Django - отдельного
+# веб-сервера перед админкой нет. 0 - если статику раздает nginx или CDN
+ADMIN_SERVE_STATIC = os.getenv('ADMIN_SERVE_STATIC', '1') == '1'
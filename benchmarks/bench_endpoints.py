@@ -0,0 +1,295 @@
+# Бенчмарк эндпоинтов API: приложение вызывается in-process через ASGI (без сети и
+# HTTP-клиента) на отдельной БД с синтетическими данными (generate_data.py).
+# Для каждого объема данных и эндпоинта: p50/p95/p99, пропускная способность, пиковый RSS.
+# Результаты пишутся в JSON (benchmarks/results/<commit>-<время>.json), --compare
+# сравнивает с прошлым прогоном.
+#
+#   POSTGRES_DB=armstrong_bench python benchmarks/bench_endpoints.py --sizes 1000,100000
+#   python benchmarks/bench_endpoints.py --skip-generate --compare benchmarks/results/old.json
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# name -> (method, path, query, form); {mid_id} подставляется по объему данных
+SCENARIOS = {
+    "products_page": ("GET", "/products", {"limit": 50}, None),
+    "products_keyset": ("GET", "/products", {"limit": 50, "after": "{mid_id}"}, None),
+    "products_filter_attr": ("GET", "/products", {"limit": 50, "attr.brand": "Knauf"}, None),
+    "products_filter_price": ("GET", "/products", {"limit": 50, "price_retail_min": 1000, "price_retail_max": 2000}, None),
+    "products_facets": ("GET", "/products/facets", {}, None),
+    "product_item": ("GET", "/products/{mid_id}", {}, None),
+    "blog_posts": ("GET", "/blog-posts", {}, None),
+    "search": ("GET", "/search", {"q": "акустический потолок"}, None),
+    "add_request": ("POST", "/add-request", {}, {"name": "Bench", "phone": "+996555000000", "comment": "Бенчмарк"}),
+    "add_review": ("POST", "/add-review", {}, {"name": "Bench", "review": "Бенчмарк"}),
+    "reviews_page": ("GET", "/reviews", {"limit": 50}, None),
+    "reviews_summary": ("GET", "/reviews/summary", {}, None),
+    # Полный список растет с таблицей - только по явному --endpoints
+    "requests_list": ("GET", "/requests", {}, None),
+}
+DEFAULT_SCENARIOS = [name for name in SCENARIOS if not name.endswith("_list")]
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # Не Linux: только пик за все время процесса (ru_maxrss в КБ на Linux, в байтах на macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Минимальный ASGI-вызов: весь запрос в одном сообщении, тело ответа собирается в bytes
+async def call(app, method, path, query="", body=b"", content_type=None):
+    headers = [(b"host", b"bench")]
+    if content_type:
+        headers.append((b"content-type", content_type.encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = 0
+    size = 0
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, size
+
+
+def build_request(name, mid_id):
+    method, path, query, form = SCENARIOS[name]
+    path = path.format(mid_id=mid_id)
+    query = urlencode({key: str(value).format(mid_id=mid_id) for key, value in query.items()})
+    if form is None:
+        return method, path, query, b"", None
+    return method, path, query, urlencode(form).encode(), "application/x-www-form-urlencoded"
+
+
+async def run_scenario(app, name, mid_id, requests, concurrency, warm_cache):
+    from cache import cache
+
+    method, path, query, body, content_type = build_request(name, mid_id)
+    latencies = []
+    errors = 0
+    peak_rss = current_rss_mb()
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors, peak_rss
+        while remaining > 0:
+            remaining -= 1
+            if not warm_cache:
+                cache.clear()
+            started = time.perf_counter()
+            status, _ = await call(app, method, path, query, body, content_type)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+            peak_rss = max(peak_rss, current_rss_mb())
+
+    # Прогрев: первый запрос открывает соединения пула и компилирует запросы
+    await call(app, method, path, query, body, content_type)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "method": method,
+        "path": path,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput_rps": len(latencies) / elapsed,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+async def run_size(size, scenarios, args):
+    from sqlalchemy import func, select
+    from database import SessionLocal
+    from main import app
+    from models import Product
+
+    results = []
+    async with app.router.lifespan_context(app):
+        async with SessionLocal() as session:
+            max_id = (await session.execute(select(func.max(Product.id)))).scalar() or 1
+        mid_id = max(1, max_id // 2)
+        for name in scenarios:
+            result = await run_scenario(
+                app, name, mid_id, args.requests, args.concurrency, args.warm_cache
+            )
+            result["size"] = size
+            results.append(result)
+            print(
+                f"{size:>9} {name:<24} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} rps  "
+                f"rss {result['peak_rss_mb']:7.1f} MB  errors {result['errors']}"
+            )
+    return results
+
+
+def generate(size, args):
+    # В отдельном процессе, чтобы память генератора не попадала в RSS бенчмарка
+    subprocess.run(
+        [
+            sys.executable, os.path.join(ROOT, "benchmarks", "generate_data.py"),
+            "--products", str(size),
+            "--blog-posts", str(min(max(10, size // 100), 2000)),
+            "--requests", str(size),
+            "--reviews", str(size),
+            "--truncate",
+        ] + (["--i-know-this-wipes-data"] if args.force_truncate else []),
+        check=True,
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_path, results):
+    with open(old_path) as old_file:
+        old = {(item["size"], item["endpoint"]): item for item in json.load(old_file)["results"]}
+    print(f"\nCompared with {old_path}:")
+    for item in results:
+        before = old.get((item["size"], item["endpoint"]))
+        if before is None:
+            continue
+        change = (item["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        print(
+            f"{item['size']:>9} {item['endpoint']:<24} p95 {before['p95_ms']:8.2f} -> "
+            f"{item['p95_ms']:8.2f} ms ({change:+.1f}%)  rps {before['throughput_rps']:8.1f} -> "
+            f"{item['throughput_rps']:8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Объемы данных (строк в каждой таблице) через запятую")
+    parser.add_argument("--endpoints", default=",".join(DEFAULT_SCENARIOS),
+                        help=f"Сценарии через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="Не сбрасывать кэш ответов перед каждым запросом")
+    parser.add_argument("--skip-generate", action="store_true",
+                        help="Использовать данные, уже загруженные в БД (один прогон)")
+    parser.add_argument("--i-know-this-wipes-data", dest="force_truncate", action="store_true",
+                        help="Генерировать данные (с TRUNCATE) в БД без суффикса _bench")
+    parser.add_argument("--output", help="Файл результатов (по умолчанию benchmarks/results/...)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.skip_generate:
+        sizes = sizes[:1]
+    else:
+        # Генерация очищает таблицы - проверяем БД до первого прогона, а не в подпроцессе
+        from database import DATABASE_URL
+        from generate_data import BENCH_DATABASE_SUFFIX, truncate_allowed
+
+        if not truncate_allowed(DATABASE_URL.database, args.force_truncate):
+            parser.error(
+                f"generating data truncates database {DATABASE_URL.database!r}: set "
+                f"POSTGRES_DB to a database ending with {BENCH_DATABASE_SUFFIX!r}, "
+                f"use --skip-generate or pass --i-know-this-wipes-data"
+            )
+
+    results = []
+    for size in sizes:
+        if not args.skip_generate:
+            generate(size, args)
+        results.extend(asyncio.run(run_size(size, scenarios, args)))
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warm_cache": args.warm_cache,
+            "sizes": sizes,
+        },
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{commit}-{stamp}.json")
+    with open(output, "w") as result_file:
+        json.dump(report, result_file, ensure_ascii=False, indent=2)
+    print(f"\nResults: {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
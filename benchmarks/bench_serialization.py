@@ -0,0 +1,85 @@
+# Микробенчмарк сериализации списков без БД: старый путь (ORM-объекты -> dict ->
+# jsonable_encoder -> json.dumps, как в JSONResponse) против RowSerializer + orjson.
+#
+#   python benchmarks/bench_serialization.py --rows 1000 --repeat 50
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from models import Product, Review
+from serializers import dumps, product_serializer, review_serializer
+
+
+def product_rows(count):
+    return [(
+        i, f"Товар {i}", {"brand": "Armstrong", "color": "белый", "article": f"A-{i}"},
+        "12 мес", "Кыргызстан", 1000 + i, 900 + i, 800 + i,
+        "Описание товара " * 20, [f"/uploads/ab/{i:064x}.jpg"],
+    ) for i in range(count)]
+
+
+def review_rows(count):
+    now = datetime.datetime(2025, 1, 1)
+    return [(i, f"Имя {i}", "Отличный сервис " * 10, now) for i in range(count)]
+
+
+def old_products(rows):
+    products = [Product(**dict(zip(product_serializer.fields, row))) for row in rows]
+    data = [{
+        "id": p.id, "title": p.title, "attributes": p.attributes, "guarantee": p.guarantee,
+        "region": p.region, "price_retail": p.price_retail, "price_wholesale": p.price_wholesale,
+        "price_bulk": p.price_bulk, "description": p.description, "images": p.images,
+    } for p in products]
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def new_products(rows):
+    return dumps(product_serializer.items(rows))
+
+
+def old_reviews(rows):
+    reviews = [Review(**dict(zip(review_serializer.fields, row))) for row in rows]
+    data = [{
+        "id": r.id, "name": r.name, "review": r.review, "created_at": r.created_at.isoformat(),
+    } for r in reviews]
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def new_reviews(rows):
+    return dumps(review_serializer.items(rows))
+
+
+def measure(func, rows, repeat):
+    func(rows)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(rows)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed * 1000, len(rows) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    cases = [
+        ("products", product_rows(args.rows), old_products, new_products),
+        ("reviews", review_rows(args.rows), old_reviews, new_reviews),
+    ]
+    for name, rows, old, new in cases:
+        old_ms, old_rps = measure(old, rows, args.repeat)
+        new_ms, new_rps = measure(new, rows, args.repeat)
+        print(f"{name:10} rows={args.rows:<7} old {old_ms:8.2f} ms ({old_rps:10.0f} rows/s)   "
+              f"new {new_ms:8.2f} ms ({new_rps:10.0f} rows/s)   x{old_ms / new_ms:.1f}")
+
+
+if __name__ == "__main__":
+    main()
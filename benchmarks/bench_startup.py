@@ -0,0 +1,57 @@
+# Холодный старт API: время импорта main.py и время от запуска uvicorn до первого
+# ответа /health (lifespan: ожидание БД, проверка версии схемы, LISTEN, кеш изображений).
+# Нужна доступная БД (те же переменные окружения, что и для API).
+#
+#   python benchmarks/bench_startup.py --repeat 5
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def measure_import():
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_first_response(port, timeout=60.0):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("API did not start in time")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8599)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeat)]
+    starts = [measure_first_response(args.port) for _ in range(args.repeat)]
+    print(f"import main:            median {statistics.median(imports) * 1000:8.1f} ms")
+    print(f"start -> first /health: median {statistics.median(starts) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Генератор синтетических данных для бенчмарков: товары с атрибутами и картинками,
+# посты блога, заявки и отзывы. Загрузка через COPY пачками, поэтому миллионы строк
+# вставляются за минуты. Запускать на отдельной БД (POSTGRES_DB=armstrong_bench):
+# --truncate очищает таблицы и разрешен только для БД с именем на _bench
+# (или с явным --i-know-this-wipes-data).
+#
+#   python benchmarks/generate_data.py --products 100000 --requests 100000 --truncate
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DATABASE_URL, dispose_engine, get_engine, wait_for_db
+from schema import ensure_schema
+
+COPY_BATCH_SIZE = 10000
+
+BRANDS = ("Armstrong", "Knauf", "Ecophon", "Rockfon", "Cesal", "Албес", "Байкал", "Potolok")
+MODELS = ("Prima", "Retail", "Oasis", "Board", "Tegular", "Sierra", "Baikal", "Cube")
+COLORS = ("белый", "серый", "черный", "бежевый", "металлик", "золото", "хром")
+SIZES = ("600x600", "600x1200", "1200x1200", "300x1200", "595x595")
+MATERIALS = ("минеральное волокно", "металл", "гипс", "ПВХ", "дерево", "стекловолокно")
+COUNTRIES = ("Россия", "Китай", "Германия", "Польша", "Казахстан", "Турция")
+REGIONS = ("Кыргызстан", "Казахстан", "Узбекистан", "Россия")
+GUARANTEES = ("6 мес", "12 мес", "24 мес", "36 мес")
+WORDS = (
+    "потолок", "плита", "подвесной", "акустический", "влагостойкий", "монтаж", "система",
+    "кассетный", "реечный", "профиль", "светильник", "офис", "ремонт", "дизайн", "покрытие",
+    "огнестойкий", "легкий", "прочный", "шумоизоляция", "гарантия", "доставка", "склад",
+)
+NAMES = ("Айбек", "Мария", "Иван", "Нурлан", "Елена", "Азамат", "Ольга", "Бакыт", "Анна", "Тимур")
+
+TABLES = ("products", "blog_posts", "requests", "reviews")
+BENCH_DATABASE_SUFFIX = "_bench"
+
+
+# Защита от TRUNCATE рабочей БД из .env
+def truncate_allowed(database=DATABASE_URL.database, force=False):
+    return force or (database or "").endswith(BENCH_DATABASE_SUFFIX)
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def image_paths(rng, count):
+    paths = []
+    for _ in range(count):
+        digest = hashlib.sha256(rng.getrandbits(64).to_bytes(8, "little")).hexdigest()
+        paths.append(f"/uploads/{digest[:2]}/{digest}.jpg")
+    return json.dumps(paths)
+
+
+def product_record(rng, number):
+    brand = rng.choice(BRANDS)
+    attributes = {
+        "article": f"BENCH-{number:08d}",
+        "brand": brand,
+        "model": rng.choice(MODELS),
+        "color": rng.choice(COLORS),
+        "size": rng.choice(SIZES),
+        "material": rng.choice(MATERIALS),
+        "country": rng.choice(COUNTRIES),
+        "weight": f"{rng.uniform(0.5, 12):.1f} кг",
+    }
+    retail = rng.randint(300, 50000)
+    return (
+        f"{brand} {attributes['model']} {attributes['size']} {attributes['color']}",
+        json.dumps(attributes, ensure_ascii=False),
+        rng.choice(GUARANTEES),
+        rng.choice(REGIONS),
+        retail,
+        int(retail * 0.9),
+        int(retail * 0.8),
+        text(rng, rng.randint(20, 80)),
+        image_paths(rng, rng.randint(1, 4)),
+    )
+
+
+def blog_post_record(rng, number):
+    return (
+        f"Статья {number}: {text(rng, 4)}",
+        "\n\n".join(text(rng, rng.randint(40, 120)) for _ in range(rng.randint(2, 6))),
+        image_paths(rng, rng.randint(0, 3)),
+    )
+
+
+def created_at(rng, now):
+    return now - datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+
+
+def request_record(rng, number, now):
+    return (
+        rng.choice(NAMES),
+        f"+996{rng.randint(500000000, 799999999)}",
+        text(rng, rng.randint(5, 30)),
+        created_at(rng, now),
+    )
+
+
+def review_record(rng, number, now):
+    return (rng.choice(NAMES), text(rng, rng.randint(10, 60)), created_at(rng, now))
+
+
+GENERATORS = {
+    "products": (
+        ("title", "attributes", "guarantee", "region", "price_retail", "price_wholesale",
+         "price_bulk", "description", "images"),
+        lambda rng, number, now: product_record(rng, number),
+    ),
+    "blog_posts": (
+        ("title", "content", "images"),
+        lambda rng, number, now: blog_post_record(rng, number),
+    ),
+    "requests": (("name", "phone", "comment", "created_at"), request_record),
+    "reviews": (("name", "review", "created_at"), review_record),
+}
+
+
+async def generate(counts, truncate=False, seed=42):
+    await wait_for_db()
+    engine = get_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(ensure_schema)
+
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    async with engine.connect() as conn:
+        raw_connection = await conn.get_raw_connection()
+        driver = raw_connection.driver_connection
+        if truncate:
+            # TRUNCATE не вызывает строчные триггеры - индекс ссылок на картинки чистим вместе с таблицами
+            await driver.execute(f"TRUNCATE {', '.join(TABLES)}, image_refs, image_orphans RESTART IDENTITY")
+        for table in TABLES:
+            count = counts.get(table, 0)
+            if not count:
+                continue
+            columns, make_record = GENERATORS[table]
+            started = time.perf_counter()
+            for offset in range(0, count, COPY_BATCH_SIZE):
+                records = [
+                    make_record(rng, number, now)
+                    for number in range(offset, min(offset + COPY_BATCH_SIZE, count))
+                ]
+                # Каждая пачка - своя транзакция (autocommit asyncpg)
+                await driver.copy_records_to_table(table, records=records, columns=columns)
+            await driver.execute(f"ANALYZE {table}")
+            print(f"{table}: {count} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    await dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--blog-posts", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--reviews", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="Очистить таблицы перед загрузкой")
+    parser.add_argument("--i-know-this-wipes-data", dest="force_truncate", action="store_true",
+                        help=f"Разрешить --truncate для БД без суффикса {BENCH_DATABASE_SUFFIX}")
+    args = parser.parse_args()
+    if args.truncate and not truncate_allowed(force=args.force_truncate):
+        parser.error(
+            f"refusing to truncate database {DATABASE_URL.database!r}: use a database whose name "
+            f"ends with {BENCH_DATABASE_SUFFIX!r} (POSTGRES_DB=armstrong_bench) or pass --i-know-this-wipes-data"
+        )
+    counts = {
+        "products": args.products,
+        "blog_posts": args.blog_posts,
+        "requests": args.requests,
+        "reviews": args.reviews,
+    }
+    asyncio.run(generate(counts, truncate=args.truncate, seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
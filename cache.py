@@ -0,0 +1,140 @@
+import os
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+# Ограничение на сумму размеров значений (в каждом воркере). Страница /products?limit=500
+# весит около мегабайта, а вместе со сжатыми вариантами - больше
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Инвалидация приходит через LISTEN/NOTIFY (notify.py), TTL - лишь страховка
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+
+
+# LRU-кэш с ограничением по размеру и времени жизни записей.
+# Ключи вида (namespace, *parts): ("product", 5), ("products", <параметры запроса>).
+# Работает в одном event loop, поэтому блокировки не нужны.
+#
+# Инвалидация может прийти, пока запрос для промаха еще выполняется - тогда в кэш попало бы
+# тело, собранное до изменения. Поэтому перед запросом берется generation(key), а set()
+# с этим значением ничего не сохраняет, если namespace за это время инвалидировали.
+#
+# Размер значения берется из его атрибута nbytes (CachedBody в compression.py), значения
+# без него считаются нулевыми и ограничены только max_entries. Если значение растет после
+# сохранения (сжатые варианты создаются при первом запросе), оно сообщает об этом через
+# on_resize, который назначает set().
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._sizes = {}               # key -> размер значения
+        self._total_bytes = 0
+        self._namespaces = {}          # namespace -> set(keys)
+        self._generations = {}         # namespace -> число инвалидаций
+        self._epoch = 0                # число clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key):
+        return self._epoch, self._generations.get(key[0], 0)
+
+    def set(self, key, value, generation=None):
+        if generation is not None and generation != self.generation(key):
+            self.stale_sets += 1
+            return
+        size = getattr(value, "nbytes", 0)
+        if self.max_bytes is not None and size > self.max_bytes:
+            self._remove(key)
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._sizes[key] = size
+        self._total_bytes += size
+        self._namespaces.setdefault(key[0], set()).add(key)
+        if hasattr(value, "on_resize"):
+            value.on_resize = lambda grown, delta: self._resize(key, grown, delta)
+        self._evict()
+
+    def _resize(self, key, value, delta):
+        entry = self._entries.get(key)
+        # Значение могли уже вытеснить или заменить
+        if entry is None or entry[1] is not value:
+            return
+        self._sizes[key] += delta
+        self._total_bytes += delta
+        self._evict()
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    # invalidate("product", 5) удаляет одну запись, invalidate("products") - весь namespace
+    def invalidate(self, namespace, *parts):
+        # Даже если записей нет: запросы, начатые до инвалидации, не должны их сохранить
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        if parts:
+            key = (namespace, *parts)
+            keys = [key] if key in self._entries else []
+        else:
+            keys = list(self._namespaces.get(namespace, ()))
+        for key in keys:
+            self._remove(key)
+        self.invalidations += len(keys)
+
+    def clear(self):
+        self._epoch += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._sizes.clear()
+        self._total_bytes = 0
+        self._namespaces.clear()
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._total_bytes -= self._sizes.pop(key, 0)
+        keys = self._namespaces.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[key[0]]
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_sets": self.stale_sets,
+        }
+
+
+cache = ResponseCache(max_bytes=CACHE_MAX_BYTES)
@@ -0,0 +1,97 @@
+from typing import Optional
+from fastapi import Request as HTTPRequest
+from sqlalchemy import case, func, literal_column, select, true
+from models import Product
+
+ATTRIBUTE_PARAM_PREFIX = "attr."
+
+# Атрибуты, по которым по умолчанию считаются фасеты (article уникален - фасет по нему бесполезен)
+FACET_KEYS = ('brand', 'model', 'color', 'size', 'weight', 'material', 'country')
+FACET_VALUES_LIMIT = 50
+
+
+# Общие фильтры каталога для GET /products и GET /products/facets.
+# Фильтры по атрибутам передаются как attr.brand=...&attr.color=...
+class ProductFilters:
+    def __init__(
+        self,
+        request: HTTPRequest,
+        region: Optional[str] = None,
+        guarantee: Optional[str] = None,
+        price_retail_min: Optional[int] = None,
+        price_retail_max: Optional[int] = None,
+        price_wholesale_min: Optional[int] = None,
+        price_wholesale_max: Optional[int] = None,
+        price_bulk_min: Optional[int] = None,
+        price_bulk_max: Optional[int] = None,
+    ):
+        self.region = region
+        self.guarantee = guarantee
+        self.price_ranges = (
+            (Product.price_retail, price_retail_min, price_retail_max),
+            (Product.price_wholesale, price_wholesale_min, price_wholesale_max),
+            (Product.price_bulk, price_bulk_min, price_bulk_max),
+        )
+        self.attributes = {
+            name[len(ATTRIBUTE_PARAM_PREFIX):]: value
+            for name, value in request.query_params.items()
+            if name.startswith(ATTRIBUTE_PARAM_PREFIX) and len(name) > len(ATTRIBUTE_PARAM_PREFIX)
+        }
+
+    def cache_key(self):
+        return (
+            self.region,
+            self.guarantee,
+            tuple((low, high) for _, low, high in self.price_ranges),
+            tuple(sorted(self.attributes.items())),
+        )
+
+    def apply(self, query):
+        if self.region is not None:
+            query = query.where(Product.region == self.region)
+        if self.guarantee is not None:
+            query = query.where(Product.guarantee == self.guarantee)
+        for column, low, high in self.price_ranges:
+            if low is not None:
+                query = query.where(column >= low)
+            if high is not None:
+                query = query.where(column <= high)
+        if self.attributes:
+            # attributes @> '{"brand": "X"}' использует GIN-индекс (jsonb_path_ops)
+            query = query.where(Product.attributes.contains(self.attributes))
+        return query
+
+
+# Количество товаров по каждому значению атрибутов одним запросом (top-N значений на ключ)
+def build_facets_query(filters, keys=FACET_KEYS, values_limit=FACET_VALUES_LIMIT):
+    # jsonb_each_text падает на массиве или скаляре, а attributes пишутся и из админки,
+    # и из /add-product без проверки типа - такие товары просто не дают фасетов. CASE, а не
+    # WHERE: порядок вычисления условия и LATERAL-функции планировщик не гарантирует
+    attributes = case(
+        (func.jsonb_typeof(Product.attributes) == "object", Product.attributes),
+        else_=literal_column("'{}'::jsonb"),
+    )
+    pairs = func.jsonb_each_text(attributes).table_valued("key", "value").lateral("kv")
+    counts = filters.apply(
+        select(
+            pairs.c.key,
+            pairs.c.value,
+            func.count().label("count"),
+        )
+        .select_from(Product)
+        .join(pairs, true())
+        .where(pairs.c.key.in_(keys))
+        .group_by(pairs.c.key, pairs.c.value)
+    ).subquery()
+    ranked = select(
+        counts,
+        func.row_number().over(
+            partition_by=counts.c.key,
+            order_by=(counts.c["count"].desc(), counts.c.value),
+        ).label("position"),
+    ).subquery()
+    return (
+        select(ranked.c.key, ranked.c.value, ranked.c["count"])
+        .where(ranked.c.position <= values_limit)
+        .order_by(ranked.c.key, ranked.c.position)
+    )
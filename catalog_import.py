@@ -0,0 +1,299 @@
+import codecs
+import csv
+import json
+
+# Массовая загрузка прайс-листа: CSV/NDJSON разбирается потоково, валидные строки
+# пачками идут через COPY во временную таблицу, затем одним merge по артикулу
+# (attributes->>'article') обновляются существующие товары и добавляются новые.
+# Перед merge: IMPORT_LOCK_SQL, затем DEDUPLICATE_STAGING_SQL.
+# Используется в POST /products/import (main.py) и в manage.py import_products.
+
+IMPORT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+# Ограничение на одну запись CSV (защита от незакрытой кавычки в большом файле)
+MAX_RECORD_CHARS = 1024 * 1024
+
+STAGING_TABLE = 'products_import'
+STAGING_COLUMNS = (
+    'line', 'article', 'title', 'attributes', 'guarantee', 'region',
+    'price_retail', 'price_wholesale', 'price_bulk', 'description', 'images',
+)
+
+CREATE_STAGING_SQL = f"""
+CREATE TEMP TABLE {STAGING_TABLE} (
+    line integer NOT NULL,
+    article varchar NOT NULL,
+    title varchar NOT NULL,
+    attributes text NOT NULL,
+    guarantee varchar,
+    region varchar,
+    price_retail integer NOT NULL,
+    price_wholesale integer NOT NULL,
+    price_bulk integer NOT NULL,
+    description text,
+    images text NOT NULL
+) ON COMMIT DROP
+"""
+
+# Merge выполняется под транзакционной advisory-блокировкой: без нее два параллельных
+# импорта одного файла не видят незакоммиченных вставок друг друга и оба добавляют товар.
+# Уникального индекса по артикулу нет - в уже существующих данных артикулы могут повторяться.
+# COPY в staging блокировку не берет, ждут только сами merge
+IMPORT_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('products_import'))"
+
+# Если артикул встречается в файле несколько раз, побеждает последняя строка.
+# Выполняется перед merge, чтобы UPDATE и INSERT читали уже очищенную staging-таблицу
+DEDUPLICATE_STAGING_SQL = f"""
+DELETE FROM {STAGING_TABLE} AS s USING {STAGING_TABLE} AS newer
+WHERE newer.article = s.article AND newer.line > s.line
+"""
+
+MERGE_UPDATE_SQL = f"""
+UPDATE products AS p SET
+    title = s.title,
+    attributes = s.attributes::jsonb,
+    guarantee = s.guarantee,
+    region = s.region,
+    price_retail = s.price_retail,
+    price_wholesale = s.price_wholesale,
+    price_bulk = s.price_bulk,
+    description = s.description,
+    images = s.images::json
+FROM {STAGING_TABLE} AS s
+WHERE p.attributes ->> 'article' = s.article
+"""
+
+MERGE_INSERT_SQL = f"""
+INSERT INTO products (
+    title, attributes, guarantee, region,
+    price_retail, price_wholesale, price_bulk, description, images
+)
+SELECT
+    s.title, s.attributes::jsonb, s.guarantee, s.region,
+    s.price_retail, s.price_wholesale, s.price_bulk, s.description, s.images::json
+FROM {STAGING_TABLE} AS s
+WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.attributes ->> 'article' = s.article)
+"""
+
+PRODUCT_FIELDS = ('title', 'guarantee', 'region', 'description')
+PRICE_FIELDS = ('price_retail', 'price_wholesale', 'price_bulk')
+# Колонки цен - integer (int4)
+PRICE_MAX = 2147483647
+
+
+class RowError(ValueError):
+    pass
+
+
+def _parse_images(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        images = value
+    elif value.lstrip().startswith('['):
+        images = json.loads(value)
+    else:
+        # В CSV удобнее перечислять через |
+        images = [part.strip() for part in value.split('|') if part.strip()]
+    if not all(isinstance(image, str) for image in images):
+        raise RowError('images must be a list of strings')
+    return images
+
+
+def _parse_attributes(value):
+    if value is None or value == '':
+        return {}
+    attributes = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(attributes, dict):
+        raise RowError('attributes must be an object')
+    return attributes
+
+
+# Цена из CSV (строка) или NDJSON (число). int() принял бы true как 1 и молча
+# отбросил бы дробную часть 1.9 - такие значения считаются ошибкой строки
+def _parse_price(field, value):
+    if isinstance(value, bool):
+        raise RowError(f'{field} must be an integer')
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise RowError(f'{field} must be an integer')
+        value = int(value)
+    try:
+        price = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be an integer')
+    if price < 0:
+        raise RowError(f'{field} must not be negative')
+    if price > PRICE_MAX:
+        raise RowError(f'{field} must not exceed {PRICE_MAX}')
+    return price
+
+
+# Postgres не хранит NUL ни в text, ни в jsonb: такое значение оборвало бы COPY
+# (или merge) всего файла, поэтому это ошибка одной строки
+def _has_nul(value):
+    if isinstance(value, str):
+        return '\x00' in value
+    if isinstance(value, dict):
+        return any(_has_nul(key) or _has_nul(item) for key, item in value.items())
+    if isinstance(value, list):
+        return any(_has_nul(item) for item in value)
+    return False
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+# dict из CSV/NDJSON -> кортеж в порядке STAGING_COLUMNS (без line)
+def validate_row(row):
+    try:
+        attributes = _parse_attributes(row.get('attributes'))
+        images = _parse_images(row.get('images'))
+    except json.JSONDecodeError as e:
+        raise RowError(f'invalid JSON: {e}')
+
+    # Все прочие колонки (brand, color, ...) считаются атрибутами товара
+    known = set(PRODUCT_FIELDS) | set(PRICE_FIELDS) | {'attributes', 'images'}
+    for key, value in row.items():
+        if key not in known and value not in (None, ''):
+            attributes[key] = value if isinstance(value, str) else str(value)
+
+    article = attributes.get('article')
+    if not article:
+        raise RowError('article is required')
+    attributes['article'] = str(article)
+
+    title = row.get('title')
+    if not title or not str(title).strip():
+        raise RowError('title is required')
+
+    prices = [_parse_price(field, row.get(field)) for field in PRICE_FIELDS]
+
+    texts = {field: _text(row.get(field)) for field in ('guarantee', 'region', 'description')}
+    texts['title'] = str(title).strip()
+    for field, value in (*texts.items(), ('attributes', attributes), ('images', images)):
+        if _has_nul(value):
+            raise RowError(f'{field} must not contain NUL characters')
+
+    return (
+        attributes['article'],
+        texts['title'],
+        json.dumps(attributes, ensure_ascii=False),
+        texts['guarantee'],
+        texts['region'],
+        *prices,
+        texts['description'],
+        json.dumps(images, ensure_ascii=False),
+    )
+
+
+# Инкрементальный разбор: feed() принимает куски bytes и возвращает готовые записи
+# (line, кортеж для COPY). Ошибки копятся в errors (не больше MAX_REPORTED_ERRORS).
+class ProductImportParser:
+    def __init__(self, fmt):
+        if fmt not in ('csv', 'ndjson'):
+            raise ValueError(f'Unknown import format: {fmt}')
+        self.format = fmt
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._tail = ''
+        self._record = []
+        self._record_quotes = 0
+        self._record_chars = 0
+        self._record_line = 0
+        self._line = 0
+        self._header = None
+        self.rows = 0
+        self.valid = 0
+        self.error_count = 0
+        self.errors = []
+
+    def feed(self, chunk):
+        text = self._tail + self._decoder.decode(chunk)
+        lines = text.split('\n')
+        self._tail = lines.pop()
+        return self._parse_lines(lines)
+
+    def close(self):
+        text = self._tail + self._decoder.decode(b'', final=True)
+        self._tail = ''
+        records = self._parse_lines([text] if text else [])
+        if self._record:
+            self._error(self._record_line, 'unterminated quoted field')
+            self._record = []
+        return records
+
+    def _error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def _parse_lines(self, lines):
+        records = []
+        for line in lines:
+            self._line += 1
+            if self.format == 'ndjson':
+                record = self._handle(self._line, line) if line.strip() else None
+                if record is not None:
+                    records.append(record)
+                continue
+
+            # CSV: поле в кавычках может содержать перевод строки - копим строки,
+            # пока число кавычек в записи не станет четным
+            if not self._record:
+                self._record_line = self._line
+            self._record.append(line)
+            self._record_quotes += line.count('"')
+            self._record_chars += len(line)
+            if self._record_quotes % 2:
+                if self._record_chars > MAX_RECORD_CHARS:
+                    self.rows += 1
+                    self._error(self._record_line, 'record is too long (unterminated quoted field?)')
+                    self._record = []
+                    self._record_quotes = 0
+                    self._record_chars = 0
+                continue
+            text = '\n'.join(self._record)
+            self._record = []
+            self._record_quotes = 0
+            self._record_chars = 0
+            record = self._handle(self._record_line, text) if text.strip() else None
+            if record is not None:
+                records.append(record)
+        return records
+
+    def _handle(self, line, text):
+        if self.format == 'csv':
+            values = next(csv.reader([text.rstrip('\r')]))
+            if self._header is None:
+                self._header = [name.strip() for name in values]
+                return None
+            row = dict(zip(self._header, values))
+        else:
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as e:
+                self.rows += 1
+                self._error(line, f'invalid JSON: {e}')
+                return None
+            if not isinstance(row, dict):
+                self.rows += 1
+                self._error(line, 'row must be an object')
+                return None
+
+        self.rows += 1
+        try:
+            record = validate_row(row)
+        except RowError as e:
+            self._error(line, str(e))
+            return None
+        self.valid += 1
+        return (line, *record)
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'valid': self.valid,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
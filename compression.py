@@ -0,0 +1,203 @@
+import gzip
+import hashlib
+import os
+import zlib
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from static_files import etag_matches
+
+try:
+    import brotli
+except ImportError:
+    # brotli необязателен: без него клиенты получают gzip
+    brotli = None
+
+# Сжатие ответов API по Accept-Encoding (br предпочтительнее gzip).
+# Обычные ответы сжимает CompressionMiddleware на каждый запрос. Закэшированные тела
+# (CachedBody в ResponseCache) сжимаются один раз на версию содержимого и отдаются
+# CachedJSONResponse вместе с ETag: повторный запрос с If-None-Match получает 304.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Закэшированное тело сжимается один раз - можно сильнее
+CACHED_GZIP_LEVEL = int(os.getenv("CACHED_GZIP_LEVEL", "9"))
+CACHED_BROTLI_QUALITY = int(os.getenv("CACHED_BROTLI_QUALITY", "9"))
+# Тела крупнее сжимаются в пуле потоков, чтобы не останавливать event loop
+COMPRESSION_THREAD_THRESHOLD = 256 * 1024
+
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "image/svg+xml", "text/",
+)
+
+
+# "gzip, deflate, br;q=0.9" -> "br" | "gzip" | None; при равном q выигрывает br
+def negotiate_encoding(accept_encoding):
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        weight = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body, encoding, cached=False):
+    if encoding == "br":
+        return brotli.compress(body, quality=CACHED_BROTLI_QUALITY if cached else BROTLI_QUALITY)
+    # mtime=0: одинаковое тело дает одинаковые байты
+    return gzip.compress(body, compresslevel=CACHED_GZIP_LEVEL if cached else GZIP_LEVEL, mtime=0)
+
+
+async def compress_async(body, encoding, cached=False):
+    if len(body) > COMPRESSION_THREAD_THRESHOLD:
+        return await run_in_threadpool(compress, body, encoding, cached)
+    return compress(body, encoding, cached)
+
+
+class StreamCompressor:
+    def __init__(self, encoding):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.process = self._compressor.process
+            self.finish = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.process = self._compressor.compress
+            self.finish = self._compressor.flush
+
+
+# Тело ответа для ResponseCache: ETag считается один раз, сжатые варианты - при первом запросе.
+# nbytes включает сжатые варианты: кэш ограничен по сумме размеров (cache.CACHE_MAX_BYTES)
+class CachedBody:
+    __slots__ = ("body", "etag", "nbytes", "on_resize", "_encoded")
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.nbytes = len(body)
+        self.on_resize = None
+        self._encoded = {}
+
+    async def encoded(self, encoding):
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = await compress_async(self.body, encoding, cached=True)
+            # Два одновременных запроса могли сжать тело параллельно - учитываем один раз
+            if encoding not in self._encoded:
+                self._encoded[encoding] = data
+                self.nbytes += len(data)
+                if self.on_resize is not None:
+                    self.on_resize(self, len(data))
+            data = self._encoded[encoding]
+        return data
+
+
+class CachedJSONResponse(Response):
+    media_type = "application/json"
+
+    def __init__(self, entry, status_code=200, headers=None):
+        self.entry = entry
+        super().__init__(entry.body, status_code, headers)
+
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        encoding = None
+        if len(self.entry.body) >= COMPRESSION_MIN_SIZE:
+            encoding = negotiate_encoding(request_headers.get("accept-encoding"))
+        # Разные представления - разные сильные ETag
+        etag = f'"{self.entry.etag}-{encoding}"' if encoding else f'"{self.entry.etag}"'
+        self.headers["etag"] = etag
+        self.headers.add_vary_header("Accept-Encoding")
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            not_modified = Response(status_code=304, headers={"etag": etag, "vary": self.headers["vary"]})
+            return await not_modified(scope, receive, send)
+
+        if encoding is not None:
+            self.body = await self.entry.encoded(encoding)
+            self.headers["content-encoding"] = encoding
+            self.headers["content-length"] = str(len(self.body))
+        await super().__call__(scope, receive, send)
+
+
+def _compressible(status, headers):
+    if status != 200 or "content-encoding" in headers:
+        return False
+    # Файлы (FileResponse с Range и сильным ETag файла) не трогаем
+    if "accept-ranges" in headers or "content-range" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Заголовки отправляются вместе с первым куском тела, когда известен его размер
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                body = compressor.process(body)
+                if not more_body:
+                    body += compressor.finish()
+                return await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+            headers = MutableHeaders(raw=start["headers"])
+            if not _compressible(start["status"], headers) or (not more_body and len(body) < self.minimum_size):
+                passthrough = True
+                await send(start)
+                return await send(message)
+
+            headers["content-encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body:
+                body = await compress_async(body, encoding)
+                headers["content-length"] = str(len(body))
+                await send(start)
+                return await send({"type": "http.response.body", "body": body, "more_body": False})
+
+            # Потоковый ответ (выгрузки): длина заранее неизвестна
+            if "content-length" in headers:
+                del headers["content-length"]
+            compressor = StreamCompressor(encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": compressor.process(body), "more_body": True})
+
+        await self.app(scope, receive, compressing_send)
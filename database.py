@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from metrics import InstrumentedQueuePool
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = URL.create(
+    "postgresql+asyncpg",
+    username=os.getenv("POSTGRES_USER"),
+    password=os.getenv("POSTGRES_PASSWORD"),
+    host=os.getenv("DB_HOST", "db"),
+    port=int(os.getenv("DB_PORT", "5432")),
+    database=os.getenv("POSTGRES_DB"),
+)
+
+# Параметры пула соединений (переопределяются через переменные окружения)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+
+# Сколько ждать готовности БД при старте (контейнер с Postgres может подниматься дольше API)
+DB_WAIT_TIMEOUT = float(os.getenv("DB_WAIT_TIMEOUT", "60"))
+
+# Engine создается лениво (get_engine() в lifespan API): импорт модулей не открывает
+# соединений и не зависит от доступности БД
+_engine = None
+
+# expire_on_commit=False: после commit атрибуты (например product.id) читаются без нового запроса
+SessionLocal = async_sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            DATABASE_URL,
+            poolclass=InstrumentedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args={
+                "timeout": DB_CONNECT_TIMEOUT,
+                "command_timeout": DB_COMMAND_TIMEOUT,
+            },
+        )
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+async def dispose_engine():
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+
+
+# После fork (gunicorn post_fork): унаследованный пул бросаем, не закрывая соединения -
+# они принадлежат родителю. Следующий get_engine() создаст свой engine в этом процессе
+def forget_engine():
+    global _engine
+    if _engine is not None:
+        _engine.sync_engine.dispose(close=False)
+        _engine = None
+
+
+# Опрос БД вместо фиксированного sleep: SELECT 1 с растущей паузой до DB_WAIT_TIMEOUT
+async def wait_for_db(timeout=DB_WAIT_TIMEOUT):
+    engine = get_engine()
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    while True:
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return
+        except Exception as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            logger.info("Database is not ready (%s), retrying in %.1fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+
+# Одна сессия на запрос (FastAPI dependency)
+async def get_db():
+    async with SessionLocal() as session:
+        yield session
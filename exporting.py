@@ -0,0 +1,74 @@
+import csv
+import datetime
+import io
+import zlib
+import orjson
+
+# Потоковая выгрузка таблиц в NDJSON/CSV (опционально gzip).
+# Используется в GET /export/{table} (main.py) и в manage.py export_data.
+
+EXPORT_BATCH_SIZE = 2000
+
+EXPORT_FIELDS = {
+    'products': (
+        'id', 'title', 'attributes', 'guarantee', 'region',
+        'price_retail', 'price_wholesale', 'price_bulk', 'description', 'images',
+    ),
+    'requests': ('id', 'name', 'phone', 'comment', 'created_at'),
+    'reviews': ('id', 'name', 'review', 'created_at'),
+}
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode()
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+# Кодирует пачки строк (кортежи в порядке fields) в bytes; состояние gzip живет между пачками
+class ExportEncoder:
+    def __init__(self, fmt, fields, compress=False):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format: {fmt}')
+        self.format = fmt
+        self.fields = tuple(fields)
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    @property
+    def media_type(self):
+        return 'application/gzip' if self._compressor else EXPORT_FORMATS[self.format][0]
+
+    def filename(self, name):
+        extension = EXPORT_FORMATS[self.format][1]
+        return f'{name}.{extension}.gz' if self._compressor else f'{name}.{extension}'
+
+    def _output(self, data):
+        return self._compressor.compress(data) if self._compressor else data
+
+    def header(self):
+        if self.format != 'csv':
+            return b''
+        return self._output(self._csv_bytes([self.fields]))
+
+    def encode(self, rows):
+        if self.format == 'csv':
+            data = self._csv_bytes([[_csv_value(value) for value in row] for row in rows])
+        else:
+            fields = self.fields
+            data = b''.join(orjson.dumps(dict(zip(fields, row))) + b'\n' for row in rows)
+        return self._output(data)
+
+    def finish(self):
+        return self._compressor.flush() if self._compressor else b''
+
+    def _csv_bytes(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
@@ -0,0 +1,117 @@
+# Продакшен-запуск API: gunicorn с воркерами uvicorn (uvloop и httptools подхватываются
+# автоматически, если установлены - см. Dockerfile).
+#
+#   gunicorn main:app -c gunicorn.conf.py
+#
+# kill -HUP <master> - плавный перезапуск воркеров (старые дообрабатывают запросы),
+# kill -TERM - остановка с ожиданием graceful_timeout. При GUNICORN_PRELOAD=1 код загружен
+# в мастере, поэтому новый код подхватывается только полным перезапуском (или USR2 + WINCH).
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from dotenv import load_dotenv
+
+# Как и database.py: переменные из .env, если они не заданы в окружении
+load_dotenv()
+
+logger = logging.getLogger("gunicorn.error")
+
+bind = os.getenv("API_BIND", "0.0.0.0:8538")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("API_WORKERS") or multiprocessing.cpu_count())
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Перезапуск воркера после N запросов (со случайным разбросом, чтобы не все сразу) -
+# ограничивает рост памяти
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+
+# --- Размер пула соединений на воркер ---
+# Соединения Postgres делятся между всеми воркерами API, админкой и служебными подключениями.
+# Если DB_POOL_SIZE/DB_MAX_OVERFLOW не заданы явно, они считаются из max_connections:
+#   (max_connections - DB_RESERVED_CONNECTIONS - ADMIN_WORKERS) / workers
+# минус одно соединение воркера на LISTEN (notify.py); 2/3 - постоянный пул, остальное - overflow.
+# Считается до импорта приложения: database.py читает переменные окружения при импорте.
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "10"))
+ADMIN_WORKERS = int(os.getenv("ADMIN_WORKERS", "2"))
+# Больше одному async-воркеру не нужно - лишние соединения только занимают память Postgres
+DB_MAX_CONNECTIONS_PER_WORKER = int(os.getenv("DB_MAX_CONNECTIONS_PER_WORKER", "30"))
+LISTENER_CONNECTIONS_PER_WORKER = 1
+
+
+async def _max_connections():
+    import asyncpg
+
+    connection = await asyncpg.connect(
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("DB_HOST", "db"),
+        port=int(os.getenv("DB_PORT", "5432")),
+        database=os.getenv("POSTGRES_DB"),
+        timeout=float(os.getenv("DB_CONNECT_TIMEOUT", "10")),
+    )
+    try:
+        return int(await connection.fetchval("SHOW max_connections"))
+    finally:
+        await connection.close()
+
+
+def pool_sizing(max_connections, workers, reserved=DB_RESERVED_CONNECTIONS, admin=ADMIN_WORKERS):
+    per_worker = (max_connections - reserved - admin) // max(workers, 1) - LISTENER_CONNECTIONS_PER_WORKER
+    per_worker = min(max(per_worker, 2), DB_MAX_CONNECTIONS_PER_WORKER)
+    pool_size = max(1, per_worker * 2 // 3)
+    return pool_size, per_worker - pool_size
+
+
+def _configure_pool():
+    if "DB_POOL_SIZE" in os.environ and "DB_MAX_OVERFLOW" in os.environ:
+        return
+    try:
+        max_connections = asyncio.run(_max_connections())
+    except Exception as e:
+        logger.warning("Could not read max_connections (%s), using default pool size", e)
+        return
+    pool_size, max_overflow = pool_sizing(max_connections, workers)
+    os.environ.setdefault("DB_POOL_SIZE", str(pool_size))
+    os.environ.setdefault("DB_MAX_OVERFLOW", str(max_overflow))
+    logger.info(
+        "max_connections=%d, %d workers: pool_size=%s, max_overflow=%s per worker",
+        max_connections, workers, os.environ["DB_POOL_SIZE"], os.environ["DB_MAX_OVERFLOW"],
+    )
+
+
+_configure_pool()
+
+# /metrics любого воркера отдает сумму по всем воркерам: процессы пишут снимки в общий
+# каталог (metrics.py). Задается до загрузки приложения - metrics.py читает его при импорте
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "armstrong-metrics"))
+
+
+def on_starting(server):
+    from metrics import reset_snapshots
+
+    reset_snapshots(os.environ["METRICS_DIR"])
+
+
+def child_exit(server, worker):
+    # Счетчики завершившегося (или перезапущенного по max_requests) воркера - в архив
+    from metrics import mark_process_dead
+
+    mark_process_dead(worker.pid, os.environ["METRICS_DIR"])
+
+
+def post_fork(server, worker):
+    # Engine создается лениво в lifespan воркера; если мастер успел его создать,
+    # сокеты его пула не должны использоваться в нескольких процессах сразу
+    from database import forget_engine
+
+    forget_engine()
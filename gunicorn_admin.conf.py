@@ -0,0 +1,27 @@
+# Продакшен-запуск админки (Django, WSGI):
+#
+#   gunicorn admin_panel.wsgi:application -c gunicorn_admin.conf.py
+#
+# Синхронные воркеры: админка - немного пользователей и длинные запросы к БД,
+# каждый воркер держит одно постоянное соединение (CONN_MAX_AGE).
+import os
+
+bind = os.getenv("ADMIN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("ADMIN_WORKERS", "2"))
+worker_class = "sync"
+# Без preload каждый воркер импортирует Django сам: kill -HUP подхватывает новый код,
+# а соединения с БД никогда не переходят через fork
+preload_app = False
+
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+# Выгрузки и массовые действия в админке бывают долгими
+timeout = int(os.getenv("ADMIN_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+
+# Настройки Django для продакшена, если не заданы явно (читаются при импорте settings)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "admin_panel.settings")
+os.environ.setdefault("DJANGO_DEBUG", "0")
+os.environ.setdefault("DJANGO_CONN_MAX_AGE", "60")
+
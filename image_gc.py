@@ -0,0 +1,397 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import stat
+import time
+
+from storage import UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+# Сборщик неиспользуемых загрузок. Ссылки на файлы из products.images и blog_posts.images
+# поддерживают триггеры в таблице image_refs (schema.py). Файл без ссылок сначала переносится
+# в карантин (uploads/.quarantine), а удаляется только после срока хранения - если за это
+# время ссылка появилась снова, файл возвращается на место.
+#
+# Полный обход uploads/ не нужен: файлы удаленных товаров и постов приходят из очереди
+# image_orphans, а каталоги-шарды (ab/ из storage.hashed_path) перечитываются, только
+# если изменились с прошлого прохода (mtime каталога) или в них ждут своего срока молодые файлы.
+IMAGE_GC_GRACE_SECONDS = float(os.getenv("IMAGE_GC_GRACE_SECONDS", str(24 * 3600)))
+IMAGE_GC_QUARANTINE_SECONDS = float(os.getenv("IMAGE_GC_QUARANTINE_SECONDS", str(7 * 24 * 3600)))
+IMAGE_GC_SHARDS_PER_RUN = int(os.getenv("IMAGE_GC_SHARDS_PER_RUN", "32"))
+# Период фонового запуска в API, секунд. По умолчанию 0 - фоновый GC выключен и запускается
+# только вручную (manage.py gc_images). Включается явно, например IMAGE_GC_INTERVAL=3600;
+# из всех процессов API (воркеров gunicorn) проходы по расписанию выполняет один -
+# тот, что держит блокировку uploads/.quarantine/.scheduler
+IMAGE_GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", "0"))
+IMAGE_GC_BATCH_SIZE = 1000
+
+# "" - корень uploads/ (старые файлы, загруженные до хранения по хешу)
+SHARDS = [""] + [f"{i:02x}" for i in range(256)]
+
+
+# Путь из БД (ab/ab12...jpg) -> безопасный относительный путь или None.
+# images заполняется извне, поэтому ../ и служебные каталоги (.tmp, .quarantine) отсекаем
+def safe_relative_path(path):
+    parts = path.split("/")
+    if not path or len(parts) > 2 or any(not part or part.startswith(".") for part in parts):
+        return None
+    return path
+
+
+def _new_report():
+    return {
+        "orphans_checked": 0,
+        "shards_scanned": 0,
+        "files_scanned": 0,
+        "skipped_young": 0,
+        "quarantined": 0,
+        "quarantined_bytes": 0,
+        "restored": 0,
+        "deleted": 0,
+        "reclaimed_bytes": 0,
+        "quarantine_files": 0,
+        "quarantine_bytes": 0,
+        "seconds": 0.0,
+    }
+
+
+class ImageGC:
+    def __init__(
+        self,
+        upload_dir=UPLOAD_DIR,
+        grace_seconds=IMAGE_GC_GRACE_SECONDS,
+        quarantine_seconds=IMAGE_GC_QUARANTINE_SECONDS,
+        shards_per_run=IMAGE_GC_SHARDS_PER_RUN,
+    ):
+        self.upload_dir = upload_dir
+        self.quarantine_dir = os.path.join(upload_dir, ".quarantine")
+        self.state_path = os.path.join(self.quarantine_dir, ".state.json")
+        self.lock_path = os.path.join(self.quarantine_dir, ".lock")
+        self.grace_seconds = grace_seconds
+        self.quarantine_seconds = quarantine_seconds
+        self.shards_per_run = shards_per_run
+        self.last_report = None
+        self.totals = {"runs": 0, "quarantined": 0, "restored": 0, "deleted": 0, "reclaimed_bytes": 0}
+        self._store = None
+        self._task = None
+        self._scheduler_fd = None
+        self._handled = set()
+
+    # Блокирующий проход; store - источник ссылок (см. AsyncImageRefStore и manage.py gc_images).
+    # Возвращает отчет или None, если GC уже выполняется другим процессом
+    def run(self, store, full=False, shards_per_run=None, dry_run=False):
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        started = time.perf_counter()
+        with open(self.lock_path, "a") as lock:
+            try:
+                # Воркеры API и manage.py работают с одним каталогом - проход выполняет один
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            report = _new_report()
+            self._handled = set()
+            state = self._load_state()
+            self._collect_orphans(store, state, report, dry_run)
+            self._scan_shards(store, state, report, full, shards_per_run or self.shards_per_run, dry_run)
+            self._sweep_quarantine(store, report, dry_run)
+            if not dry_run:
+                self._save_state(state)
+        report["seconds"] = time.perf_counter() - started
+
+        if not dry_run:
+            self.totals["runs"] += 1
+            for key in ("quarantined", "restored", "deleted", "reclaimed_bytes"):
+                self.totals[key] += report[key]
+            self.last_report = report
+        return report
+
+    def stats(self):
+        stats = dict(self.totals)
+        if self.last_report is not None:
+            stats["last_run_seconds"] = self.last_report["seconds"]
+            stats["quarantine_files"] = self.last_report["quarantine_files"]
+            stats["quarantine_bytes"] = self.last_report["quarantine_bytes"]
+        return stats
+
+    # --- Фоновый запуск из lifespan API ---
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self, get_engine, interval=IMAGE_GC_INTERVAL):
+        self._store = AsyncImageRefStore(asyncio.get_running_loop(), get_engine)
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Проход в потоке не прерывается отменой - закрытое хранилище завершает его на ближайшем запросе
+        self._store.closed = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._scheduler_fd is not None:
+            # close снимает flock - расписание подхватит другой воркер
+            os.close(self._scheduler_fd)
+            self._scheduler_fd = None
+
+    # Блокировка держится, пока процесс жив; остальные воркеры пробуют взять ее на каждом
+    # тике и начинают проходы, если владелец завершился
+    def _acquire_scheduler(self):
+        if self._scheduler_fd is not None:
+            return True
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.quarantine_dir, ".scheduler"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._scheduler_fd = fd
+        return True
+
+    async def _run(self, interval):
+        from starlette.concurrency import run_in_threadpool
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not self._acquire_scheduler():
+                    continue
+                report = await run_in_threadpool(self.run, self._store)
+            except Exception:
+                logger.exception("Image GC failed")
+                continue
+            if report is not None and (report["quarantined"] or report["deleted"] or report["restored"]):
+                logger.info(
+                    "Image GC: quarantined %d (%d bytes), restored %d, deleted %d, reclaimed %d bytes in %.2fs",
+                    report["quarantined"], report["quarantined_bytes"], report["restored"],
+                    report["deleted"], report["reclaimed_bytes"], report["seconds"],
+                )
+
+    # --- Состояние шардов: {"cursor": индекс, "shards": {шард: {"mtime_ns", "recheck_at"}}} ---
+    def _load_state(self):
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("cursor", 0)
+        state.setdefault("shards", {})
+        return state
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def _recheck_later(self, state, shard, mtime):
+        entry = state["shards"].setdefault(shard, {"mtime_ns": None, "recheck_at": None})
+        recheck_at = mtime + self.grace_seconds
+        if entry["recheck_at"] is None or recheck_at < entry["recheck_at"]:
+            entry["recheck_at"] = recheck_at
+
+    # --- Перенос в карантин ---
+    def _quarantine(self, relative_path, size, report, dry_run):
+        # Файл из очереди может встретиться и при обходе шарда (в dry run он остается на месте)
+        if relative_path in self._handled:
+            return
+        self._handled.add(relative_path)
+        report["quarantined"] += 1
+        report["quarantined_bytes"] += size
+        if dry_run:
+            return
+        target = os.path.join(self.quarantine_dir, relative_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(os.path.join(self.upload_dir, relative_path), target)
+        except FileNotFoundError:
+            report["quarantined"] -= 1
+            report["quarantined_bytes"] -= size
+            return
+        # mtime в карантине - время переноса, от него считается срок хранения
+        os.utime(target)
+
+    # Кандидаты [(путь, stat)] -> в карантин те, на которые нет ссылок
+    def _quarantine_unreferenced(self, store, candidates, report, dry_run):
+        for offset in range(0, len(candidates), IMAGE_GC_BATCH_SIZE):
+            batch = candidates[offset:offset + IMAGE_GC_BATCH_SIZE]
+            referenced = store.referenced([path for path, _ in batch])
+            for path, stat_result in batch:
+                if path not in referenced:
+                    self._quarantine(path, stat_result.st_size, report, dry_run)
+
+    # --- 1. Очередь освобожденных путей ---
+    def _collect_orphans(self, store, state, report, dry_run):
+        now = time.time()
+        while True:
+            orphans, released_until = store.orphans(IMAGE_GC_BATCH_SIZE)
+            if not orphans:
+                return
+            report["orphans_checked"] += len(orphans)
+            candidates = []
+            for path in orphans:
+                relative_path = safe_relative_path(path)
+                if relative_path is None:
+                    continue
+                try:
+                    stat_result = os.lstat(os.path.join(self.upload_dir, relative_path))
+                except OSError:
+                    continue
+                if not stat.S_ISREG(stat_result.st_mode):
+                    continue
+                if now - stat_result.st_mtime < self.grace_seconds:
+                    # Файл загружали недавно - решит обход шарда, когда истечет льготный срок
+                    report["skipped_young"] += 1
+                    shard = relative_path.split("/")[0] if "/" in relative_path else ""
+                    self._recheck_later(state, shard, stat_result.st_mtime)
+                    continue
+                candidates.append((relative_path, stat_result))
+            self._quarantine_unreferenced(store, candidates, report, dry_run)
+            if dry_run:
+                return
+            store.forget_orphans(orphans, released_until)
+            if len(orphans) < IMAGE_GC_BATCH_SIZE:
+                return
+
+    # --- 2. Шарды, изменившиеся с прошлого прохода ---
+    def _shard_dir(self, shard):
+        return os.path.join(self.upload_dir, shard) if shard else self.upload_dir
+
+    def _needs_scan(self, state, shard, mtime_ns, now, full):
+        entry = state["shards"].get(shard)
+        if full or entry is None or entry["mtime_ns"] != mtime_ns:
+            return True
+        return entry["recheck_at"] is not None and entry["recheck_at"] <= now
+
+    def _scan_shards(self, store, state, report, full, limit, dry_run):
+        now = time.time()
+        cursor = state["cursor"] % len(SHARDS)
+        for step in range(len(SHARDS)):
+            if report["shards_scanned"] >= limit:
+                break
+            index = (cursor + step) % len(SHARDS)
+            shard = SHARDS[index]
+            try:
+                # mtime снимаем до чтения: файл, добавленный во время обхода, даст повторный проход
+                mtime_ns = os.stat(self._shard_dir(shard)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if not self._needs_scan(state, shard, mtime_ns, now, full):
+                continue
+            self._scan_shard(store, state, shard, mtime_ns, now, report, dry_run)
+            state["cursor"] = index + 1
+
+    def _scan_shard(self, store, state, shard, mtime_ns, now, report, dry_run):
+        report["shards_scanned"] += 1
+        state["shards"][shard] = {"mtime_ns": mtime_ns, "recheck_at": None}
+        candidates = []
+        with os.scandir(self._shard_dir(shard)) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                    continue
+                report["files_scanned"] += 1
+                stat_result = entry.stat(follow_symlinks=False)
+                if now - stat_result.st_mtime < self.grace_seconds:
+                    report["skipped_young"] += 1
+                    self._recheck_later(state, shard, stat_result.st_mtime)
+                    continue
+                candidates.append((f"{shard}/{entry.name}" if shard else entry.name, stat_result))
+        self._quarantine_unreferenced(store, candidates, report, dry_run)
+
+    # --- 3. Карантин: вернуть файлы, на которые снова сослались, удалить просроченные ---
+    def _sweep_quarantine(self, store, report, dry_run):
+        now = time.time()
+        files = []
+        for root, dirs, names in os.walk(self.quarantine_dir):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in names:
+                if name.startswith("."):
+                    continue
+                full_path = os.path.join(root, name)
+                relative_path = os.path.relpath(full_path, self.quarantine_dir).replace(os.sep, "/")
+                try:
+                    files.append((relative_path, full_path, os.stat(full_path)))
+                except FileNotFoundError:
+                    continue
+
+        for offset in range(0, len(files), IMAGE_GC_BATCH_SIZE):
+            batch = files[offset:offset + IMAGE_GC_BATCH_SIZE]
+            referenced = store.referenced([path for path, _, _ in batch])
+            for relative_path, full_path, stat_result in batch:
+                if relative_path in referenced:
+                    report["restored"] += 1
+                    if not dry_run:
+                        self._restore(relative_path, full_path)
+                elif now - stat_result.st_mtime >= self.quarantine_seconds:
+                    report["deleted"] += 1
+                    report["reclaimed_bytes"] += stat_result.st_size
+                    if not dry_run:
+                        os.remove(full_path)
+                else:
+                    report["quarantine_files"] += 1
+                    report["quarantine_bytes"] += stat_result.st_size
+
+    def _restore(self, relative_path, full_path):
+        target = os.path.join(self.upload_dir, relative_path)
+        if os.path.exists(target):
+            # Файл успели загрузить заново - копия из карантина не нужна
+            os.remove(full_path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(full_path, target)
+
+
+image_gc = ImageGC()
+
+
+# Синхронный интерфейс ссылок для прохода GC в пуле потоков поверх async-движка API:
+# запросы выполняются в event loop, поток ждет результат
+class AsyncImageRefStore:
+    def __init__(self, loop, get_engine):
+        self.loop = loop
+        self.get_engine = get_engine
+        self.closed = False
+
+    def _call(self, coroutine):
+        if self.closed:
+            coroutine.close()
+            raise RuntimeError("Image GC store is closed")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _fetch(self, statement, parameters):
+        from sqlalchemy import text
+
+        async with self.get_engine().connect() as conn:
+            result = await conn.execute(text(statement), parameters)
+            rows = result.all()
+            await conn.commit()
+        return rows
+
+    def referenced(self, paths):
+        rows = self._call(self._fetch(
+            "SELECT DISTINCT path FROM image_refs WHERE path = ANY(:paths)", {"paths": list(paths)}
+        ))
+        return {row[0] for row in rows}
+
+    # Возвращает (пути, released_at последнего): forget_orphans не удалит запись,
+    # освобожденную повторно уже после чтения
+    def orphans(self, limit):
+        rows = self._call(self._fetch(
+            "SELECT path, released_at FROM image_orphans ORDER BY released_at LIMIT :limit",
+            {"limit": limit},
+        ))
+        return [row[0] for row in rows], (rows[-1][1] if rows else None)
+
+    def forget_orphans(self, paths, released_until):
+        self._call(self._fetch(
+            "DELETE FROM image_orphans WHERE path = ANY(:paths) AND released_at <= :until RETURNING path",
+            {"paths": list(paths), "until": released_until},
+        ))
@@ -0,0 +1,240 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import orjson
+from PIL import Image, ImageOps
+from storage import UPLOAD_DIR
+
+# Производные картинки (/img/{width}x{height}/{path}) кэшируются на диске.
+# Каталог ограничен по размеру, при переполнении удаляются давно не запрошенные файлы.
+# Каталог и учет занятого места (.usage под flock на .lock) общие для всех воркеров
+# gunicorn, поэтому лимит действует на весь сервер, а не на каждый процесс.
+IMAGE_CACHE_DIR = os.getenv(
+    "IMAGE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "images"),
+)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Файлы моложе этого (по atime) не удаляются, даже если лимит превышен
+IMAGE_CACHE_EVICT_GRACE = float(os.getenv("IMAGE_CACHE_EVICT_GRACE", "60"))
+# Удаление идет до этой доли лимита, чтобы не сканировать каталог после каждой генерации
+IMAGE_CACHE_LOW_WATERMARK = 0.9
+IMAGE_CACHE_STALE_TMP_SECONDS = 3600
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "4096"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+
+Image.init()
+
+# MIME-тип -> формат Pillow, в порядке предпочтения при согласовании по Accept
+NEGOTIATED_FORMATS = [
+    (mime, fmt) for mime, fmt in (("image/avif", "AVIF"), ("image/webp", "WEBP"))
+    if fmt in Image.SAVE
+]
+FORMAT_EXTENSIONS = {"AVIF": ".avif", "WEBP": ".webp", "JPEG": ".jpg", "PNG": ".png", "GIF": ".gif"}
+SOURCE_FORMATS = {
+    ".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".gif": "GIF", ".webp": "WEBP",
+}
+FORMAT_MIME_TYPES = {
+    "AVIF": "image/avif", "WEBP": "image/webp", "JPEG": "image/jpeg",
+    "PNG": "image/png", "GIF": "image/gif",
+}
+
+
+def negotiate_format(accept, source_path):
+    accept = accept or ""
+    for mime, fmt in NEGOTIATED_FORMATS:
+        if mime in accept:
+            return fmt
+    return SOURCE_FORMATS.get(os.path.splitext(source_path)[1].lower(), "PNG")
+
+
+# Выполняется в отдельном процессе (ProcessPoolExecutor): ресайз не держит GIL воркера API
+def render_derivative(source_path, target_path, width, height, target_format):
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width or IMAGE_MAX_DIMENSION, height or IMAGE_MAX_DIMENSION))
+        if target_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp_path = f"{target_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, format=target_format, quality=IMAGE_QUALITY)
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+class DerivativeCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock_path = os.path.join(directory, ".lock")
+        self._usage_path = os.path.join(directory, ".usage")
+        self._pending = {}           # имя файла -> Future генерации (склейка одинаковых запросов)
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            self._write_usage(self._scan_and_evict())
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @contextmanager
+    def _locked(self):
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # close снимает flock
+            os.close(fd)
+
+    def _read_usage(self):
+        try:
+            with open(self._usage_path, "rb") as usage_file:
+                return orjson.loads(usage_file.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+
+    def _write_usage(self, usage):
+        tmp_path = f"{self._usage_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as usage_file:
+            usage_file.write(orjson.dumps(usage))
+        os.replace(tmp_path, self._usage_path)
+
+    # Под блокировкой: пересчет занятого места по каталогу и удаление давно не запрошенных
+    # файлов (по atime) до IMAGE_CACHE_LOW_WATERMARK от лимита
+    def _scan_and_evict(self):
+        now = time.time()
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    # Остатки генерации, прерванной падением процесса
+                    if stat.st_mtime < now - IMAGE_CACHE_STALE_TMP_SECONDS:
+                        os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, entry.name, stat.st_size))
+            total += stat.st_size
+
+        files = len(entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * IMAGE_CACHE_LOW_WATERMARK
+            for atime, name, size in sorted(entries):
+                # Файл, только что созданный или отданный другим воркером, не трогаем:
+                # его FileResponse может еще не открыть файл
+                if total <= target or atime > now - IMAGE_CACHE_EVICT_GRACE:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+                files -= 1
+                self.evictions += 1
+        return {"bytes": total, "files": files}
+
+    # Выполняется в пуле потоков после генерации. Счетчик в .usage - оценка (одинаковый файл,
+    # созданный двумя воркерами, учтется дважды), точное значение восстанавливает сканирование
+    def _account(self, size):
+        with self._locked():
+            usage = self._read_usage()
+            if usage is None:
+                usage = self._scan_and_evict()
+            else:
+                usage["bytes"] += size
+                usage["files"] += 1
+                if usage["bytes"] > self.max_bytes:
+                    usage = self._scan_and_evict()
+            self._write_usage(usage)
+
+    # Отметка использования для LRU. mtime не меняем - от него зависят ETag и Last-Modified
+    # ответа; atime обновляется не чаще раза в IMAGE_CACHE_EVICT_GRACE / 2, поэтому после
+    # попадания у файла всегда есть не меньше половины grace-периода до возможного удаления
+    def _touch(self, target_path):
+        stat = os.stat(target_path)
+        now_ns = time.time_ns()
+        if stat.st_atime_ns < now_ns - int(IMAGE_CACHE_EVICT_GRACE / 2 * 1e9):
+            os.utime(target_path, ns=(now_ns, stat.st_mtime_ns))
+
+    async def get(self, source_path, width, height, accept):
+        stat = os.stat(source_path)
+        fmt = negotiate_format(accept, source_path)
+        key = hashlib.sha1(
+            f"{source_path}:{stat.st_mtime_ns}:{width}x{height}:{fmt}".encode()
+        ).hexdigest()
+        name = key + FORMAT_EXTENSIONS[fmt]
+        target_path = os.path.join(self.directory, name)
+
+        # Каталог общий для всех воркеров: файл мог создать или удалить другой процесс,
+        # поэтому проверяется только диск. Удаленный файл генерируется заново
+        try:
+            self._touch(target_path)
+            self.hits += 1
+            return target_path, FORMAT_MIME_TYPES[fmt]
+        except FileNotFoundError:
+            pass
+
+        pending = self._pending.get(name)
+        if pending is None:
+            self.misses += 1
+            pending = asyncio.ensure_future(
+                self._render(source_path, target_path, width, height, fmt)
+            )
+            self._pending[name] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(name, None))
+        # shield: отключившийся клиент не отменяет генерацию для остальных ожидающих
+        await asyncio.shield(pending)
+        return target_path, FORMAT_MIME_TYPES[fmt]
+
+    async def _render(self, source_path, target_path, width, height, fmt):
+        loop = asyncio.get_running_loop()
+        size = await loop.run_in_executor(
+            self._executor(), render_derivative, source_path, target_path, width, height, fmt
+        )
+        await loop.run_in_executor(None, self._account, size)
+
+    def stats(self):
+        usage = self._read_usage() or {"bytes": 0, "files": 0}
+        return {
+            "files": usage["files"],
+            "bytes": usage["bytes"],
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def resolve_upload(path):
+    # Как и /uploads (UploadStaticFiles): служебные каталоги (.tmp, карантин GC) недоступны
+    if any(part.startswith(".") for part in path.replace(os.sep, "/").split("/")):
+        raise FileNotFoundError(path)
+    full_path = os.path.realpath(os.path.join(UPLOAD_DIR, path))
+    if not full_path.startswith(os.path.realpath(UPLOAD_DIR) + os.sep):
+        raise FileNotFoundError(path)
+    if not os.path.isfile(full_path):
+        raise FileNotFoundError(path)
+    return full_path
+
+
+derivative_cache = DerivativeCache()
@@ -1,26 +1,87 @@
 import os
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, CompanyInfo, Product, BlogPost, Request, Review
-from fastapi.staticfiles import StaticFiles
-from dotenv import load_dotenv
+import datetime
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, Form, HTTPException, Depends, Query, Header
+from fastapi import Request as HTTPRequest
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import delete, insert, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import CompanyInfo, Product, BlogPost, Request, Review, ReviewStats
+from database import SessionLocal, dispose_engine, get_db, get_engine, wait_for_db
+from schema import ensure_schema
+from cache import cache
+from search import SEARCH_TYPES, build_search_query
+from catalog import FACET_KEYS, ProductFilters, build_facets_query
+from catalog_import import (
+    CREATE_STAGING_SQL, DEDUPLICATE_STAGING_SQL, IMPORT_BATCH_SIZE, IMPORT_LOCK_SQL,
+    MERGE_INSERT_SQL, MERGE_UPDATE_SQL, STAGING_COLUMNS, STAGING_TABLE, ProductImportParser
+)
+from serializers import (
+    JSONBytesResponse, dumps, company_info_serializer, product_serializer,
+    blog_post_serializer, request_serializer, review_serializer, RowSerializer
+)
+from exporting import EXPORT_BATCH_SIZE, EXPORT_FIELDS, ExportEncoder
+from schemas import BATCH_MAX_ITEMS, BlogPostIn, ProductIn, QuoteIn, batch_items, validate_batch
+from pricing import PRICE_QUERY, build_quote, price_cache
+from notify import change_listener
+from write_behind import WRITE_BEHIND_ENABLED, write_behind
+from image_gc import IMAGE_GC_INTERVAL, image_gc
+from metrics import (
+    METRICS_DIR, MetricsMiddleware, pool_collector, registry, snapshot_writer, stats_collector, upload_bytes,
+)
+from slow_queries import QuerySourceMiddleware, api_slow_query_log, install_sqlalchemy_hooks
+from storage import UPLOAD_DIR, CHUNK_SIZE, MAX_UPLOAD_SIZE, UploadTooLarge, UploadWriter, is_content_addressed
+from multipart_upload import MULTIPART_OVERHEAD, UPLOAD_OPENAPI, InvalidUpload, MultipartFileParser
+from static_files import IMMUTABLE_CACHE_CONTROL, UploadStaticFiles
+from compression import CachedBody, CachedJSONResponse, CompressionMiddleware
+from images import IMAGE_MAX_DIMENSION, derivative_cache, resolve_upload
+from PIL import UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
 import json
+import orjson
 from fastapi.middleware.cors import CORSMiddleware
 
-load_dotenv()
-
-DATABASE_URL = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@db:5432/{os.getenv('POSTGRES_DB')}"
+# Создаем папку uploads если не существует
+os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-Base.metadata.create_all(engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Все ресурсы (engine, схема, LISTEN, пул обработки изображений, журнал заявок)
+# поднимаются здесь, а не при импорте модуля
+@asynccontextmanager
+async def lifespan(app):
+    started = time.perf_counter()
+    await wait_for_db()
+    async with get_engine().begin() as conn:
+        schema_updated = await conn.run_sync(ensure_schema)
+    change_listener.start()
+    derivative_cache.load()
+    if WRITE_BEHIND_ENABLED:
+        await write_behind.start()
+    if IMAGE_GC_INTERVAL > 0:
+        image_gc.start(get_engine)
+    if METRICS_DIR:
+        snapshot_writer.start()
+    app.state.startup_seconds = time.perf_counter() - started
+    logger.info(
+        "Startup finished in %.3fs (schema %s)",
+        app.state.startup_seconds, "updated" if schema_updated else "up to date",
+    )
+    try:
+        yield
+    finally:
+        await snapshot_writer.stop()
+        await image_gc.stop()
+        await write_behind.stop()
+        await change_listener.stop()
+        derivative_cache.shutdown()
+        await dispose_engine()
 
-# Создаем папку uploads если не существует
-os.makedirs("uploads", exist_ok=True)
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.mount("/uploads", UploadStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,14 +90,165 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Внутри метрик: http_response_size_bytes считает уже сжатые байты
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(QuerySourceMiddleware)
+# Последним добавлен - значит самый внешний: время включает CORS и все остальное
+app.add_middleware(MetricsMiddleware)
+
+install_sqlalchemy_hooks(api_slow_query_log, get_engine)
+
+registry.add_collector(pool_collector(lambda: get_engine().pool))
+CACHE_COUNTERS = ("hits", "misses", "evictions", "invalidations", "stale_sets")
+registry.add_collector(stats_collector("response_cache", cache.stats, CACHE_COUNTERS))
+registry.add_collector(stats_collector("price_cache", price_cache.stats, CACHE_COUNTERS))
+registry.add_collector(stats_collector("image_cache", derivative_cache.stats, CACHE_COUNTERS))
+registry.add_collector(stats_collector(
+    "write_behind", write_behind.stats, ("submitted", "flushed", "batches", "failures", "replayed", "failed_segments", "failed_rows")))
+registry.add_collector(stats_collector(
+    "image_gc", image_gc.stats, ("runs", "quarantined", "restored", "deleted", "reclaimed_bytes")))
+
+# Общая часть POST /products/batch и POST /blog-posts/batch: тело - JSON-массив
+# (или {"items": [...]}), невалидные элементы возвращаются в errors с индексом,
+# валидные вставляются одним INSERT ... RETURNING id
+async def insert_batch(request, db, model, schema):
+    try:
+        items = batch_items(orjson.loads(await request.body()))
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if items is None:
+        raise HTTPException(status_code=400, detail="Expected a JSON array of objects")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items")
+
+    rows, indexes, errors = validate_batch(schema, items)
+    ids = []
+    if rows:
+        try:
+            result = await db.execute(
+                insert(model).returning(model.id, sort_by_parameter_order=True), rows
+            )
+            ids = result.scalars().all()
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "status": "ok" if not errors else "partial",
+        "inserted": len(ids),
+        "items": [{"index": index, "id": id_} for index, id_ in zip(indexes, ids)],
+        "errors": errors,
+    }
+
+# created_at хранится как UTC без часового пояса
+def naive_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+# DELETE ... RETURNING id: один запрос вместо SELECT + ORM delete; None, если строки не было
+async def delete_by_id(db, model, row_id):
+    try:
+        deleted = (await db.execute(
+            delete(model).where(model.id == row_id).returning(model.id)
+        )).scalar_one_or_none()
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    return deleted
+
+# Массовое удаление по списку id и/или по created_at < older_than (условия объединяются через AND)
+async def delete_bulk(db, model, ids, older_than):
+    if not ids and older_than is None:
+        raise HTTPException(status_code=400, detail="Specify ids or older_than")
+    query = delete(model).returning(model.id)
+    if ids:
+        query = query.where(model.id.in_(ids))
+    if older_than is not None:
+        query = query.where(model.created_at < naive_utc(older_than))
+    try:
+        deleted = (await db.execute(query)).scalars().all()
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    report = {"status": "ok", "deleted": len(deleted)}
+    if ids:
+        report["not_found"] = sorted(set(ids) - set(deleted))
+    return report
 
 # === IMAGE UPLOAD ===
-@app.post("/upload-image")
-async def upload_image(file: UploadFile = File(...)):
-    file_path = f"uploads/{file.filename}"
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    return {"path": f"/uploads/{file.filename}"}
+# multipart/form-data с полем file. Тело читается потоково и сразу пишется в хранилище:
+# слишком большой файл отклоняется по Content-Length до чтения тела или как только
+# прочитано больше MAX_UPLOAD_SIZE
+@app.post("/upload-image", openapi_extra=UPLOAD_OPENAPI)
+async def upload_image(request: HTTPRequest):
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_SIZE} bytes")
+    try:
+        parser = MultipartFileParser(request.headers.get("content-type"))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    writer = await run_in_threadpool(UploadWriter)
+    try:
+        pending = []
+        pending_size = 0
+        async for chunk in request.stream():
+            for data in parser.feed(chunk):
+                pending.append(data)
+                pending_size += len(data)
+            if writer.size + pending_size > MAX_UPLOAD_SIZE:
+                raise UploadTooLarge(f"File is larger than {MAX_UPLOAD_SIZE} bytes")
+            # Хэширование и запись идут пачками в пуле потоков, а не в event loop
+            if pending_size >= CHUNK_SIZE:
+                await run_in_threadpool(writer.write, b"".join(pending))
+                pending = []
+                pending_size = 0
+        parser.close()
+        if pending:
+            await run_in_threadpool(writer.write, b"".join(pending))
+        path = await run_in_threadpool(writer.commit, parser.filename)
+    except BaseException as e:
+        writer.abort()
+        if isinstance(e, InvalidUpload):
+            raise HTTPException(status_code=400, detail=str(e))
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        raise
+    upload_bytes.inc(writer.size)
+    return {"path": path}
+
+# === IMAGE RESIZE ===
+# /img/300x0/f9/f9289f...png - вписать в 300px по ширине (0 = без ограничения)
+@app.get("/img/{width}x{height}/{path:path}")
+async def get_resized_image(
+    width: int,
+    height: int,
+    path: str,
+    accept: Optional[str] = Header(None)
+):
+    if not (0 <= width <= IMAGE_MAX_DIMENSION and 0 <= height <= IMAGE_MAX_DIMENSION) or not (width or height):
+        raise HTTPException(status_code=400, detail="Invalid image size")
+    try:
+        source_path = resolve_upload(path)
+        file_path, media_type = await derivative_cache.get(source_path, width, height, accept)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail="Not an image")
+    cache_control = IMMUTABLE_CACHE_CONTROL if is_content_addressed(path) else "public, max-age=86400"
+    return FileResponse(
+        file_path,
+        media_type=media_type,
+        headers={"Vary": "Accept", "Cache-Control": cache_control}
+    )
+
+@app.get("/img/stats")
+async def image_cache_stats():
+    return derivative_cache.stats()
 
 # === COMPANY INFO ===
 @app.post("/company-info")
@@ -44,12 +256,12 @@ async def update_company_info(
     phone: str = Form(...),
     email: str = Form(...),
     address: str = Form(...),
-    social_links: str = Form(...)  # JSON строка
+    social_links: str = Form(...),  # JSON строка
+    db: AsyncSession = Depends(get_db)
 ):
-    db = Session()
     try:
         # Удаляем существующую запись (если есть)
-        db.query(CompanyInfo).delete()
+        await db.execute(delete(CompanyInfo))
         
         # Создаем новую запись
         company_info = CompanyInfo(
@@ -59,30 +271,28 @@ async def update_company_info(
             social_links=json.loads(social_links)
         )
         db.add(company_info)
-        db.commit()
+        await db.commit()
+        cache.invalidate("company_info")
         return {"status": "ok"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 @app.get("/company-info")
-async def get_company_info():
-    db = Session()
-    try:
-        company_info = db.query(CompanyInfo).first()
-        if not company_info:
-            raise HTTPException(status_code=404, detail="Company info not found")
-        
-        return {
-            "phone": company_info.phone,
-            "email": company_info.email,
-            "address": company_info.address,
-            "social_links": company_info.social_links
-        }
-    finally:
-        db.close()
+async def get_company_info(db: AsyncSession = Depends(get_db)):
+    cached = cache.get(("company_info",))
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(("company_info",))
+
+    row = (await db.execute(company_info_serializer.select().limit(1))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Company info not found")
+    
+    body = dumps(company_info_serializer.item(row))
+    cached = CachedBody(body)
+    cache.set(("company_info",), cached, generation)
+    return CachedJSONResponse(cached)
 
 # === PRODUCTS ===
 @app.post("/add-product")
@@ -95,9 +305,9 @@ async def add_product(
     price_bulk: int = Form(...),
     description: str = Form(...),
     attributes: str = Form(...),  # JSON строка
-    images: str = Form(...)       # JSON строка
+    images: str = Form(...),      # JSON строка
+    db: AsyncSession = Depends(get_db)
 ):
-    db = Session()
     try:
         product = Product(
             title=title,
@@ -111,82 +321,176 @@ async def add_product(
             images=json.loads(images)
         )
         db.add(product)
-        db.commit()
+        await db.commit()
+        cache.invalidate("products")
+        cache.invalidate("product_facets")
+        cache.invalidate("search")
         return {"status": "ok", "product_id": product.id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+
+@app.post("/products/batch")
+async def add_products_batch(request: HTTPRequest, db: AsyncSession = Depends(get_db)):
+    report = await insert_batch(request, db, Product, ProductIn)
+    if report["inserted"]:
+        cache.invalidate("products")
+        cache.invalidate("product_facets")
+        cache.invalidate("search")
+    return report
 
 @app.get("/products")
-async def get_products():
-    db = Session()
-    try:
-        products = db.query(Product).all()
-        return [{
-            "id": p.id,
-            "title": p.title,
-            "attributes": p.attributes,
-            "guarantee": p.guarantee,
-            "region": p.region,
-            "price_retail": p.price_retail,
-            "price_wholesale": p.price_wholesale,
-            "price_bulk": p.price_bulk,
-            "description": p.description,
-            "images": p.images
-        } for p in products]
-    finally:
-        db.close()
+async def get_products(
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[int] = None,  # id последнего товара с предыдущей страницы
+    filters: ProductFilters = Depends(),
+    db: AsyncSession = Depends(get_db)
+):
+    cache_key = ("products", limit, after, filters.cache_key())
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(cache_key)
+
+    # Keyset-пагинация: WHERE id > after ORDER BY id LIMIT n, без OFFSET
+    query = filters.apply(product_serializer.select().order_by(Product.id).limit(limit + 1))
+    if after is not None:
+        query = query.where(Product.id > after)
+
+    rows = (await db.execute(query)).all()
+    # Лишняя строка нужна только чтобы узнать, есть ли следующая страница
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    body = dumps({
+        "items": product_serializer.items(rows),
+        "next_after": rows[-1].id if has_more else None
+    })
+    cached = CachedBody(body)
+    cache.set(cache_key, cached, generation)
+    return CachedJSONResponse(cached)
+
+@app.get("/products/facets")
+async def get_product_facets(
+    keys: Optional[str] = None,  # через запятую, по умолчанию FACET_KEYS
+    filters: ProductFilters = Depends(),
+    db: AsyncSession = Depends(get_db)
+):
+    facet_keys = tuple(k.strip() for k in keys.split(",") if k.strip()) if keys else FACET_KEYS
+    cache_key = ("product_facets", facet_keys, filters.cache_key())
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(cache_key)
+
+    data = {key: [] for key in facet_keys}
+    for row in await db.execute(build_facets_query(filters, facet_keys)):
+        data[row.key].append({"value": row.value, "count": row.count})
+    body = dumps(data)
+    cached = CachedBody(body)
+    cache.set(cache_key, cached, generation)
+    return CachedJSONResponse(cached)
 
 @app.get("/products/{product_id}")
-async def get_product(product_id: int):
-    db = Session()
-    try:
-        product = db.query(Product).filter(Product.id == product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        return {
-            "id": product.id,
-            "title": product.title,
-            "attributes": product.attributes,
-            "guarantee": product.guarantee,
-            "region": product.region,
-            "price_retail": product.price_retail,
-            "price_wholesale": product.price_wholesale,
-            "price_bulk": product.price_bulk,
-            "description": product.description,
-            "images": product.images
-        }
-    finally:
-        db.close()
+async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    cached = cache.get(("product", product_id))
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(("product", product_id))
+
+    row = (await db.execute(product_serializer.select().where(Product.id == product_id))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    body = dumps(product_serializer.item(row))
+    cached = CachedBody(body)
+    cache.set(("product", product_id), cached, generation)
+    return CachedJSONResponse(cached)
 
 @app.delete("/products/{product_id}")
-async def delete_product(product_id: int):
-    db = Session()
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    deleted = await delete_by_id(db, Product, product_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    cache.invalidate("product", product_id)
+    cache.invalidate("products")
+    cache.invalidate("product_facets")
+    cache.invalidate("search")
+    price_cache.invalidate("price", product_id)
+    return {"status": "ok"}
+
+# === BULK IMPORT ===
+# Тело запроса - CSV (с заголовком) или NDJSON, читается потоково:
+#   curl -X POST --data-binary @price.csv "http://.../products/import?format=csv"
+@app.post("/products/import")
+async def import_products(
+    http_request: HTTPRequest,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    db: AsyncSession = Depends(get_db)
+):
+    parser = ProductImportParser(format)
     try:
-        product = db.query(Product).filter(Product.id == product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        db.delete(product)
-        db.commit()
-        return {"status": "ok"}
+        await db.execute(text(CREATE_STAGING_SQL))
+        raw_connection = await (await db.connection()).get_raw_connection()
+        copy_connection = raw_connection.driver_connection
+
+        async def copy_batch(batch):
+            await copy_connection.copy_records_to_table(
+                STAGING_TABLE, records=batch, columns=STAGING_COLUMNS
+            )
+
+        batch = []
+        async for chunk in http_request.stream():
+            batch.extend(parser.feed(chunk))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await copy_batch(batch)
+                batch = []
+        batch.extend(parser.close())
+        if batch:
+            await copy_batch(batch)
+
+        await db.execute(text(IMPORT_LOCK_SQL))
+        await db.execute(text(DEDUPLICATE_STAGING_SQL))
+        updated = (await db.execute(text(MERGE_UPDATE_SQL))).rowcount
+        inserted = (await db.execute(text(MERGE_INSERT_SQL))).rowcount
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+
+    for namespace in ("product", "products", "product_facets", "search"):
+        cache.invalidate(namespace)
+    price_cache.clear()
+    return {"status": "ok", "updated": updated, "inserted": inserted, **parser.report()}
+
+# === QUOTE ===
+# Расчет корзины: {"items": [{"product_id": 5, "quantity": 12}, ...]} -> цены строк и итог.
+# Цены берутся из price_cache, недостающие - одним запросом по первичному ключу
+@app.post("/quote")
+async def quote(payload: QuoteIn, db: AsyncSession = Depends(get_db)):
+    lines = [(item.product_id, item.quantity) for item in payload.items]
+    prices = {}
+    missing = []
+    generation = price_cache.generation(("price",))
+    for product_id in dict.fromkeys(product_id for product_id, _ in lines):
+        cached = price_cache.get(("price", product_id))
+        if cached is None:
+            missing.append(product_id)
+        else:
+            prices[product_id] = cached
+    if missing:
+        for row in await db.execute(PRICE_QUERY, {"ids": missing}):
+            prices[row.id] = (row.price_retail, row.price_wholesale, row.price_bulk)
+            price_cache.set(("price", row.id), prices[row.id], generation)
+    return build_quote(lines, prices)
 
 # === BLOG POSTS ===
 @app.post("/add-blog-post")
 async def add_blog_post(
     title: str = Form(...),
     content: str = Form(...),
-    images: str = Form(...)  # JSON строка
+    images: str = Form(...),  # JSON строка
+    db: AsyncSession = Depends(get_db)
 ):
-    db = Session()
     try:
         blog_post = BlogPost(
             title=title,
@@ -194,70 +498,99 @@ async def add_blog_post(
             images=json.loads(images)
         )
         db.add(blog_post)
-        db.commit()
+        await db.commit()
+        cache.invalidate("blog_posts")
+        cache.invalidate("search")
         return {"status": "ok", "blog_post_id": blog_post.id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+
+@app.post("/blog-posts/batch")
+async def add_blog_posts_batch(request: HTTPRequest, db: AsyncSession = Depends(get_db)):
+    report = await insert_batch(request, db, BlogPost, BlogPostIn)
+    if report["inserted"]:
+        cache.invalidate("blog_posts")
+        cache.invalidate("search")
+    return report
 
 @app.get("/blog-posts")
-async def get_blog_posts():
-    db = Session()
-    try:
-        posts = db.query(BlogPost).all()
-        return [{
-            "id": p.id,
-            "title": p.title,
-            "content": p.content,
-            "images": p.images
-        } for p in posts]
-    finally:
-        db.close()
+async def get_blog_posts(db: AsyncSession = Depends(get_db)):
+    cached = cache.get(("blog_posts",))
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(("blog_posts",))
+
+    rows = (await db.execute(blog_post_serializer.select())).all()
+    body = dumps(blog_post_serializer.items(rows))
+    cached = CachedBody(body)
+    cache.set(("blog_posts",), cached, generation)
+    return CachedJSONResponse(cached)
 
 @app.get("/blog-posts/{post_id}")
-async def get_blog_post(post_id: int):
-    db = Session()
-    try:
-        post = db.query(BlogPost).filter(BlogPost.id == post_id).first()
-        if not post:
-            raise HTTPException(status_code=404, detail="Blog post not found")
-        
-        return {
-            "id": post.id,
-            "title": post.title,
-            "content": post.content,
-            "images": post.images
-        }
-    finally:
-        db.close()
+async def get_blog_post(post_id: int, db: AsyncSession = Depends(get_db)):
+    cached = cache.get(("blog_post", post_id))
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(("blog_post", post_id))
+
+    row = (await db.execute(blog_post_serializer.select().where(BlogPost.id == post_id))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Blog post not found")
+    
+    body = dumps(blog_post_serializer.item(row))
+    cached = CachedBody(body)
+    cache.set(("blog_post", post_id), cached, generation)
+    return CachedJSONResponse(cached)
 
 @app.delete("/blog-posts/{post_id}")
-async def delete_blog_post(post_id: int):
-    db = Session()
-    try:
-        post = db.query(BlogPost).filter(BlogPost.id == post_id).first()
-        if not post:
-            raise HTTPException(status_code=404, detail="Blog post not found")
-        
-        db.delete(post)
-        db.commit()
-        return {"status": "ok"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+async def delete_blog_post(post_id: int, db: AsyncSession = Depends(get_db)):
+    deleted = await delete_by_id(db, BlogPost, post_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Blog post not found")
+    cache.invalidate("blog_post", post_id)
+    cache.invalidate("blog_posts")
+    cache.invalidate("search")
+    return {"status": "ok"}
+
+# === SEARCH ===
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[str] = Query(None, pattern="^(products|blog_posts)$"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    types = (type,) if type else SEARCH_TYPES
+    cache_key = ("search", q, types, limit)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(cache_key)
+
+    rows = (await db.execute(build_search_query(q, types, limit))).all()
+    body = dumps([{
+        "type": r.type,
+        "id": r.id,
+        "title": r.title,
+        "rank": r.rank
+    } for r in rows])
+    cached = CachedBody(body)
+    cache.set(cache_key, cached, generation)
+    return CachedJSONResponse(cached)
 
 # === REQUESTS ===
 @app.post("/add-request")
 async def add_request(
     name: str = Form(...),
     phone: str = Form(...),
-    comment: str = Form(...)
+    comment: str = Form(...),
+    db: AsyncSession = Depends(get_db)
 ):
-    db = Session()
+    if write_behind.running:
+        # Заявка в журнале, в БД попадет пачкой; id на этот момент еще нет
+        await write_behind.submit("requests", {"name": name, "phone": phone, "comment": comment})
+        return {"status": "ok", "request_id": None, "queued": True}
     try:
         request = Request(
             name=name,
@@ -265,96 +598,185 @@ async def add_request(
             comment=comment
         )
         db.add(request)
-        db.commit()
+        await db.commit()
         return {"status": "ok", "request_id": request.id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 @app.get("/requests")
-async def get_requests():
-    db = Session()
-    try:
-        requests = db.query(Request).all()
-        return [{
-            "id": r.id,
-            "name": r.name,
-            "phone": r.phone,
-            "comment": r.comment
-        } for r in requests]
-    finally:
-        db.close()
+async def get_requests(db: AsyncSession = Depends(get_db)):
+    rows = (await db.execute(request_serializer.select())).all()
+    return JSONBytesResponse(dumps(request_serializer.items(rows)))
 
 @app.delete("/requests/{request_id}")
-async def delete_request(request_id: int):
-    db = Session()
-    try:
-        request = db.query(Request).filter(Request.id == request_id).first()
-        if not request:
-            raise HTTPException(status_code=404, detail="Request not found")
-        
-        db.delete(request)
-        db.commit()
-        return {"status": "ok"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+async def delete_request(request_id: int, db: AsyncSession = Depends(get_db)):
+    deleted = await delete_by_id(db, Request, request_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    return {"status": "ok"}
+
+# Массовое удаление обработанных заявок одной транзакцией:
+#   DELETE /requests?ids=1&ids=2  или  DELETE /requests?older_than=2024-01-01T00:00:00
+@app.delete("/requests")
+async def delete_requests(
+    ids: Optional[List[int]] = Query(None),
+    older_than: Optional[datetime.datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    return await delete_bulk(db, Request, ids, older_than)
 
 # === REVIEWS ===
 @app.post("/add-review")
 async def add_review(
     name: str = Form(...),
-    review: str = Form(...)
+    review: str = Form(...),
+    db: AsyncSession = Depends(get_db)
 ):
-    db = Session()
+    if write_behind.running:
+        await write_behind.submit("reviews", {"name": name, "review": review})
+        return {"status": "ok", "review_id": None, "queued": True}
     try:
         review_obj = Review(
             name=name,
             review=review
         )
         db.add(review_obj)
-        db.commit()
+        await db.commit()
+        cache.invalidate("reviews")
+        cache.invalidate("reviews_summary")
         return {"status": "ok", "review_id": review_obj.id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
+def review_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+# Новые сверху. Keyset по (created_at, id) - обратный обход индекса ix_reviews_created_at_id:
+#   /reviews?limit=20 -> {"items": [...], "next_after": "2024-05-01T10:00:00.123456_981"}
+#   /reviews?limit=20&after=2024-05-01T10:00:00.123456_981 - следующая страница
 @app.get("/reviews")
-async def get_reviews():
-    db = Session()
-    try:
-        reviews = db.query(Review).all()
-        return [{
-            "id": r.id,
-            "name": r.name,
-            "review": r.review,
-            "created_at": r.created_at.isoformat()
-        } for r in reviews]
-    finally:
-        db.close()
+async def get_reviews(
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    cache_key = ("reviews", limit, after)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(cache_key)
+
+    query = (
+        review_serializer.select()
+        .where(Review.created_at.isnot(None))
+        .order_by(Review.created_at.desc(), Review.id.desc())
+        .limit(limit + 1)
+    )
+    if after is not None:
+        try:
+            after_created_at, after_id = after.rsplit("_", 1)
+            after_key = (datetime.datetime.fromisoformat(after_created_at), int(after_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(Review.created_at, Review.id) < after_key)
+
+    rows = (await db.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    body = dumps({
+        "items": review_serializer.items(rows),
+        "next_after": review_cursor(rows[-1]) if has_more else None
+    })
+    cached = CachedBody(body)
+    cache.set(cache_key, cached, generation)
+    return CachedJSONResponse(cached)
+
+# Для главной: общее число отзывов (счетчик review_stats ведут триггеры) и последние N
+@app.get("/reviews/summary")
+async def get_reviews_summary(
+    latest: int = Query(5, ge=0, le=50),
+    db: AsyncSession = Depends(get_db)
+):
+    cache_key = ("reviews_summary", latest)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return CachedJSONResponse(cached)
+    generation = cache.generation(cache_key)
+
+    total = (await db.execute(select(ReviewStats.total).where(ReviewStats.id == 1))).scalar()
+    rows = []
+    if latest:
+        rows = (await db.execute(
+            review_serializer.select()
+            .where(Review.created_at.isnot(None))
+            .order_by(Review.created_at.desc(), Review.id.desc())
+            .limit(latest)
+        )).all()
+    body = dumps({"total": total or 0, "latest": review_serializer.items(rows)})
+    cached = CachedBody(body)
+    cache.set(cache_key, cached, generation)
+    return CachedJSONResponse(cached)
 
 @app.delete("/reviews/{review_id}")
-async def delete_review(review_id: int):
-    db = Session()
-    try:
-        review = db.query(Review).filter(Review.id == review_id).first()
-        if not review:
-            raise HTTPException(status_code=404, detail="Review not found")
-        
-        db.delete(review)
-        db.commit()
-        return {"status": "ok"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+async def delete_review(review_id: int, db: AsyncSession = Depends(get_db)):
+    deleted = await delete_by_id(db, Review, review_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    cache.invalidate("reviews")
+    cache.invalidate("reviews_summary")
+    return {"status": "ok"}
+
+@app.delete("/reviews")
+async def delete_reviews(
+    ids: Optional[List[int]] = Query(None),
+    older_than: Optional[datetime.datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    result = await delete_bulk(db, Review, ids, older_than)
+    cache.invalidate("reviews")
+    cache.invalidate("reviews_summary")
+    return result
+
+# === EXPORT ===
+EXPORT_MODELS = {"products": Product, "requests": Request, "reviews": Review}
+
+# Потоковая выгрузка через серверный курсор: память не растет с размером таблицы,
+# первые байты уходят клиенту сразу
+@app.get("/export/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    since: Optional[datetime.datetime] = None  # только для таблиц с created_at
+):
+    model = EXPORT_MODELS.get(table)
+    if model is None:
+        raise HTTPException(status_code=404, detail="Unknown table")
+    serializer = RowSerializer(model, EXPORT_FIELDS[table])
+    query = serializer.select().order_by(model.id)
+    if since is not None:
+        if not hasattr(model, "created_at"):
+            raise HTTPException(status_code=400, detail=f"Table {table} has no created_at")
+        query = query.where(model.created_at >= naive_utc(since))
+
+    encoder = ExportEncoder(format, serializer.fields, compress=gzip)
+
+    async def stream_rows():
+        yield encoder.header()
+        # Своя сессия: генератор работает уже после выхода из обработчика
+        async with SessionLocal() as session:
+            result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for rows in result.partitions():
+                yield encoder.encode(rows)
+        yield encoder.finish()
+
+    return StreamingResponse(
+        stream_rows(),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{encoder.filename(table)}"'}
+    )
 
 # === HEALTH CHECK ===
 @app.get("/")
@@ -365,6 +787,26 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/slow-queries")
+async def slow_queries(limit: int = Query(20, ge=1, le=200)):
+    return api_slow_query_log.top(limit)
+
+@app.get("/write-behind/stats")
+async def write_behind_stats():
+    return write_behind.stats()
+
+@app.get("/image-gc/stats")
+async def image_gc_stats():
+    return {**image_gc.stats(), "running": image_gc.running, "last_report": image_gc.last_report}
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8538)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8538)
@@ -0,0 +1,438 @@
+import asyncio
+import bisect
+import contextvars
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+import orjson
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Метрики в текстовом формате Prometheus (GET /metrics) без внешних зависимостей.
+# Значения агрегируются на месте (счетчики и корзины гистограмм), в момент запроса
+# /metrics только форматируются. Все обновления идут из event loop (SQLAlchemy выполняет
+# запросы asyncpg в greenlet того же потока), поэтому блокировки не нужны.
+#
+# Несколько воркеров gunicorn (METRICS_DIR задается в gunicorn.conf.py): каждый процесс раз
+# в METRICS_FLUSH_INTERVAL секунд пишет снимок своих значений в <METRICS_DIR>/<pid>.json,
+# а /metrics любого воркера складывает снимки всех процессов. Счетчики и гистограммы
+# суммируются; снимки завершившихся воркеров мастер переносит в archive.json
+# (mark_process_dead), поэтому суммы не уменьшаются при перезапуске воркеров.
+# Gauge относятся к своему процессу и отдаются с меткой pid.
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+ARCHIVE_SNAPSHOT = "archive.json"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _add_label(label_text, pair):
+    return label_text[:-1] + "," + pair + "}" if label_text else "{" + pair + "}"
+
+
+# families: [(name, kind, help, [(имя сэмпла, метки, значение)])]
+def _render_families(families):
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{labels} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# snapshots: [(pid или None для архива, families)]. Сэмплы гистограмм (корзины нарастающим
+# итогом, _sum, _count) складываются так же, как счетчики
+def merge_snapshots(snapshots):
+    merged = {}
+    for pid, families in snapshots:
+        for name, kind, help, samples in families:
+            family = merged.setdefault(name, (kind, help, {}))
+            values = family[2]
+            for sample_name, labels, value in samples:
+                if kind == "gauge":
+                    if pid is None:
+                        continue
+                    values[(sample_name, _add_label(labels, f'pid="{pid}"'))] = value
+                else:
+                    key = (sample_name, labels)
+                    values[key] = values.get(key, 0) + value
+    return [
+        (name, kind, help, [(sample_name, labels, value) for (sample_name, labels), value in values.items()])
+        for name, (kind, help, values) in merged.items()
+    ]
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def dec(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._values = {}  # labels -> [счетчики по корзинам (+Inf последняя), сумма]
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, labels, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, labels), total
+            yield f"{self.name}_count", _format_labels(self.labels, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    # Коллектор вызывается при каждом запросе /metrics: (name, kind, help, [(labels dict, value)])
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def families(self):
+        families = [
+            (metric.name, metric.kind, metric.help, list(metric.samples()))
+            for metric in self._metrics
+        ]
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                families.append((name, kind, help, [
+                    (name, _format_labels(labels.keys(), labels.values()), value)
+                    for labels, value in samples
+                ]))
+        return families
+
+    def render(self, directory=METRICS_DIR):
+        if directory is None:
+            return _render_families(self.families())
+        # Свои значения - на момент запроса, остальных воркеров - из их последних снимков
+        self.write_snapshot(directory)
+        snapshots = []
+        with _locked(directory, fcntl.LOCK_SH):
+            for entry in os.scandir(directory):
+                if not entry.name.endswith(".json"):
+                    continue
+                families = _read_snapshot(entry.path)
+                if families is not None:
+                    pid = None if entry.name == ARCHIVE_SNAPSHOT else entry.name[:-len(".json")]
+                    snapshots.append((pid, families))
+        return _render_families(merge_snapshots(snapshots))
+
+    def write_snapshot(self, directory=METRICS_DIR):
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        _write_snapshot(path, self.families())
+
+
+@contextmanager
+def _locked(directory, operation):
+    fd = os.open(os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, operation)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, "rb") as snapshot_file:
+            return orjson.loads(snapshot_file.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+
+def _write_snapshot(path, families):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(orjson.dumps(families))
+    os.replace(tmp_path, path)
+
+
+# Мастер gunicorn (child_exit): счетчики завершившегося воркера переходят в архив
+def mark_process_dead(pid, directory=METRICS_DIR):
+    path = os.path.join(directory, f"{pid}.json")
+    with _locked(directory, fcntl.LOCK_EX):
+        families = _read_snapshot(path)
+        if families is None:
+            return
+        archive_path = os.path.join(directory, ARCHIVE_SNAPSHOT)
+        archive = _read_snapshot(archive_path) or []
+        _write_snapshot(archive_path, merge_snapshots([(None, archive), (None, families)]))
+        os.remove(path)
+
+
+# Мастер gunicorn (on_starting): снимки прошлого запуска не относятся к новым процессам
+def reset_snapshots(directory=METRICS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with _locked(directory, fcntl.LOCK_EX):
+        for entry in os.scandir(directory):
+            if entry.name.endswith((".json", ".json.tmp")):
+                os.remove(entry.path)
+
+
+# Периодическая запись снимка воркера (lifespan API, только при METRICS_DIR)
+class SnapshotWriter:
+    def __init__(self, registry, directory=METRICS_DIR, interval=METRICS_FLUSH_INTERVAL):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Последние значения - до выхода процесса, мастер перенесет их в архив
+        self.registry.write_snapshot(self.directory)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.registry.write_snapshot(self.directory)
+            except Exception as e:
+                logger.warning("Could not write metrics snapshot: %s", e)
+
+
+registry = Registry()
+snapshot_writer = SnapshotWriter(registry)
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", LATENCY_BUCKETS, ("route", "method")))
+http_response_size = registry.register(Histogram(
+    "http_response_size_bytes", "HTTP response body size", SIZE_BUCKETS, ("route",)))
+http_request_bytes = registry.register(Counter(
+    "http_request_bytes_total", "HTTP request body bytes received", ("route",)))
+http_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being processed"))
+db_queries_per_request = registry.register(Histogram(
+    "http_request_db_queries", "DB queries executed per HTTP request", COUNT_BUCKETS, ("route",)))
+db_time_per_request = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in DB queries per HTTP request", LATENCY_BUCKETS, ("route",)))
+db_queries = registry.register(Counter(
+    "db_queries_total", "DB queries executed"))
+db_query_latency = registry.register(Histogram(
+    "db_query_duration_seconds", "DB query latency", QUERY_BUCKETS))
+db_pool_checkouts = registry.register(Counter(
+    "db_pool_checkouts_total", "Connections checked out of the pool"))
+db_pool_wait = registry.register(Histogram(
+    "db_pool_wait_seconds", "Time waiting for a pool connection", QUERY_BUCKETS))
+db_pool_timeouts = registry.register(Counter(
+    "db_pool_timeouts_total", "Pool checkouts that failed (timeout or connect error)"))
+upload_bytes = registry.register(Counter(
+    "upload_bytes_total", "Bytes of uploaded images"))
+http_in_flight.set(0)
+
+
+# [запросов, секунд] текущего HTTP-запроса; None вне запроса (фоновые задачи)
+_request_db = contextvars.ContextVar("request_db", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    db_queries.inc()
+    db_query_latency.observe(elapsed)
+    stats = _request_db.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None:
+        started = context.connection.info.get("query_started")
+        if started:
+            started.pop()
+
+
+# Пул с замером ожидания свободного соединения (poolclass для create_async_engine)
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            db_pool_timeouts.inc()
+            raise
+        db_pool_wait.observe(time.perf_counter() - started)
+        db_pool_checkouts.inc()
+        return connection
+
+
+def pool_collector(get_pool):
+    def collect():
+        pool = get_pool()
+        if pool is None:
+            return []
+        return [
+            ("db_pool_size", "gauge", "Configured pool size", [({}, pool.size())]),
+            ("db_pool_checked_out", "gauge", "Connections currently checked out", [({}, pool.checkedout())]),
+            ("db_pool_checked_in", "gauge", "Idle connections in the pool", [({}, pool.checkedin())]),
+            ("db_pool_overflow", "gauge", "Connections opened above pool_size", [({}, max(pool.overflow(), 0))]),
+        ]
+    return collect
+
+
+def stats_collector(prefix, get_stats, counters=()):
+    # Числовые поля stats() (кэш, журнал заявок и т.п.): накопительные (counters) - как
+    # counter с суффиксом _total, остальные - как gauge
+    def collect():
+        families = []
+        for key, value in get_stats().items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            if key in counters:
+                families.append((f"{prefix}_{key}_total", "counter", f"{prefix} {key}", [({}, value)]))
+            else:
+                families.append((f"{prefix}_{key}", "gauge", f"{prefix} {key}", [({}, value)]))
+        return families
+    return collect
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_name(self, scope):
+        # Шаблон пути (/products/{product_id}), а не сам путь - иначе метки без предела
+        endpoint = scope.get("endpoint")
+        if endpoint is not None:
+            if self._routes is None:
+                self._routes = {}
+                for route in scope["app"].routes:
+                    # У Mount (/uploads) вместо endpoint - вложенное приложение
+                    target = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                    if target is not None:
+                        self._routes.setdefault(target, route.path)
+            return self._routes.get(endpoint, "<unknown>")
+        return "<unmatched>"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        db_stats = [0, 0.0]
+        token = _request_db.set(db_stats)
+        status = 500
+        response_bytes = 0
+        request_bytes = 0
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            http_in_flight.dec()
+            _request_db.reset(token)
+            route = self._route_name(scope)
+            method = scope["method"]
+            http_requests.inc(1, route, method, str(status))
+            http_latency.observe(time.perf_counter() - started, route, method)
+            http_response_size.observe(response_bytes, route)
+            if request_bytes:
+                http_request_bytes.inc(request_bytes, route)
+            db_queries_per_request.observe(db_stats[0], route)
+            db_time_per_request.observe(db_stats[1], route)
@@ -1,9 +1,22 @@
-from sqlalchemy import Column, Integer, String, JSON, Text, DateTime
+from sqlalchemy import Column, BigInteger, Integer, String, JSON, Text, DateTime, Index, Computed, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 import datetime
 
 Base = declarative_base()
 
+# Конфигурация полнотекстового поиска (используется и в админке)
+SEARCH_CONFIG = 'russian'
+
+
+def search_vector_expression(title_column, body_column):
+    # Заголовок весит больше текста (вес A против B) при ранжировании
+    return (
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({title_column}, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({body_column}, '')), 'B')"
+    )
+
 class CompanyInfo(Base):
     __tablename__ = 'company_info'
     
@@ -15,10 +28,23 @@ class CompanyInfo(Base):
 
 class Product(Base):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Индексы под фильтры и keyset-пагинацию GET /products (ORDER BY id)
+        Index('ix_products_region_id', 'region', 'id'),
+        Index('ix_products_guarantee_id', 'guarantee', 'id'),
+        Index('ix_products_price_retail', 'price_retail'),
+        Index('ix_products_price_wholesale', 'price_wholesale'),
+        Index('ix_products_price_bulk', 'price_bulk'),
+        Index('ix_products_search_vector', 'search_vector', postgresql_using='gin'),
+        # Фильтр attributes @> {...} в GET /products
+        Index('ix_products_attributes', 'attributes', postgresql_using='gin', postgresql_ops={'attributes': 'jsonb_path_ops'}),
+        # Ключ upsert при массовом импорте (catalog_import.py)
+        Index('ix_products_article', text("(attributes ->> 'article')")),
+    )
     
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
-    attributes = Column(JSON)  # {"Освещение": "Лампы", "состав материала": "дерево", "материалы из": "Европа"}
+    attributes = Column(JSONB)  # {"Освещение": "Лампы", "состав материала": "дерево", "материалы из": "Европа"}
     guarantee = Column(String)  # "12 мес"
     region = Column(String)     # "Кыргызстан"
     price_retail = Column(Integer)
@@ -26,27 +52,68 @@ class Product(Base):
     price_bulk = Column(Integer)
     description = Column(Text)
     images = Column(JSON)  # ["/uploads/img1.jpg", "/uploads/img2.jpg"]
+    # Поддерживается самим Postgres (GENERATED ... STORED), в обычные запросы не загружается
+    search_vector = deferred(Column(TSVECTOR, Computed(search_vector_expression('title', 'description'), persisted=True)))
 
 class BlogPost(Base):
     __tablename__ = 'blog_posts'
+    __table_args__ = (
+        Index('ix_blog_posts_search_vector', 'search_vector', postgresql_using='gin'),
+    )
     
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     images = Column(JSON)  # ["/uploads/blog1.jpg", "/uploads/blog2.jpg"]
+    search_vector = deferred(Column(TSVECTOR, Computed(search_vector_expression('title', 'content'), persisted=True)))
 
 class Request(Base):
     __tablename__ = 'requests'
+    __table_args__ = (
+        Index('ix_requests_created_at', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     phone = Column(String, nullable=False)
     comment = Column(Text)
+    # server_default заполняет старые строки при добавлении колонки и вставки из админки
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, server_default=text("(now() at time zone 'utc')"))
 
 class Review(Base):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        # Фильтры по дате и сортировка по (created_at, id) в админке и API
+        Index('ix_reviews_created_at_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     review = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, server_default=text("(now() at time zone 'utc')"))
+
+# Итоги по отзывам для GET /reviews/summary (одна строка id=1), ведутся триггерами (schema.py)
+class ReviewStats(Base):
+    __tablename__ = 'review_stats'
+
+    id = Column(Integer, primary_key=True)
+    total = Column(BigInteger, nullable=False, server_default=text('0'))
+
+# Индекс ссылок на загруженные файлы из products.images и blog_posts.images.
+# Заполняется триггерами (schema.py), читается сборщиком неиспользуемых файлов (image_gc.py)
+class ImageRef(Base):
+    __tablename__ = 'image_refs'
+    __table_args__ = (
+        Index('ix_image_refs_row', 'table_name', 'row_id'),
+    )
+
+    path = Column(String, primary_key=True)  # относительно uploads/: "ab/ab12...jpg"
+    table_name = Column(String, primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+
+# Файлы, на которые пропала последняя ссылка (очередь для image_gc.py, пишут те же триггеры)
+class ImageOrphan(Base):
+    __tablename__ = 'image_orphans'
+
+    path = Column(String, primary_key=True)
+    released_at = Column(DateTime, nullable=False, server_default=text("(now() at time zone 'utc')"))
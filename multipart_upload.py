@@ -0,0 +1,100 @@
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+# Потоковый разбор multipart/form-data для POST /upload-image. UploadFile Starlette сначала
+# целиком сохраняет тело в свой временный файл, и только потом его можно проверить и
+# скопировать в хранилище. Здесь байты нужного поля отдаются по мере чтения тела
+# (storage.UploadWriter хэширует и пишет их сразу), остальные поля пропускаются.
+# Запас на заголовки частей и разделители сверх размера самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Тело в OpenAPI: эндпоинт читает запрос сам, FastAPI не выводит схему из параметров
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}},
+        }}},
+    },
+}
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+# feed() принимает куски тела и возвращает куски содержимого поля field (первого с именем файла);
+# после close() в filename - имя файла из Content-Disposition
+class MultipartFileParser:
+    def __init__(self, content_type, field="file"):
+        mime, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if mime != b"multipart/form-data" or not boundary:
+            raise InvalidUpload("Expected multipart/form-data")
+        self.field = field
+        self.filename = None
+        self.complete = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._in_field = False
+        self._chunks = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        self._in_field = (
+            not self.complete and self.filename is None
+            and name == self.field and filename is not None
+        )
+        if self._in_field:
+            self.filename = filename.decode("utf-8", "replace")
+
+    def _on_part_data(self, data, start, end):
+        if self._in_field:
+            self._chunks.append(data[start:end])
+
+    def _on_part_end(self):
+        if self._in_field:
+            self._in_field = False
+            self.complete = True
+
+    def feed(self, chunk):
+        try:
+            self._parser.write(chunk)
+        except MultipartParseError as e:
+            raise InvalidUpload(f"Invalid multipart body: {e}")
+        chunks = self._chunks
+        self._chunks = []
+        return chunks
+
+    def close(self):
+        self._parser.finalize()
+        if not self.complete:
+            raise InvalidUpload(f"Field '{self.field}' with a file is required")
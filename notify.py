@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import asyncpg
+from cache import cache
+from pricing import price_cache
+from database import DATABASE_URL
+from schema import CHANGES_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Таблица -> (namespace отдельной записи, namespaces списков), которые надо сбросить
+CACHE_DEPENDENCIES = {
+    'products': ('product', ['products', 'product_facets', 'search']),
+    'blog_posts': ('blog_post', ['blog_posts', 'search']),
+    'company_info': (None, ['company_info']),
+    # Уведомление на оператор (без id): пакетная вставка сбрасывает кэш один раз
+    'reviews': (None, ['reviews', 'reviews_summary']),
+}
+
+HEALTHCHECK_INTERVAL = 10
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
+
+
+def apply_change(payload):
+    try:
+        change = json.loads(payload)
+    except json.JSONDecodeError:
+        logger.warning("Bad change notification: %r", payload)
+        return
+    dependencies = CACHE_DEPENDENCIES.get(change.get('table'))
+    if dependencies is None:
+        return
+    item_namespace, list_namespaces = dependencies
+    if item_namespace and change.get('id') is not None:
+        cache.invalidate(item_namespace, change['id'])
+    for namespace in list_namespaces:
+        cache.invalidate(namespace)
+    if change.get('table') == 'products' and change.get('id') is not None:
+        price_cache.invalidate('price', change['id'])
+
+
+# Отдельное соединение (вне пула), подписанное на CHANGES_CHANNEL.
+# Пока соединения нет, уведомления теряются, поэтому после переподключения кэш очищается целиком.
+class ChangeListener:
+    def __init__(self):
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        apply_change(payload)
+
+    async def _connect(self):
+        url = DATABASE_URL
+        return await asyncpg.connect(
+            user=url.username,
+            password=url.password,
+            host=url.host,
+            port=url.port,
+            database=url.database,
+        )
+
+    async def _run(self):
+        delay = RECONNECT_DELAY
+        while True:
+            connection = None
+            try:
+                connection = await self._connect()
+                await connection.add_listener(CHANGES_CHANNEL, self._on_notify)
+                cache.clear()
+                price_cache.clear()
+                delay = RECONNECT_DELAY
+                while True:
+                    await asyncio.sleep(HEALTHCHECK_INTERVAL)
+                    await connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Change listener disconnected: %s", e)
+                cache.clear()
+                price_cache.clear()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+
+
+change_listener = ChangeListener()
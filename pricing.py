@@ -0,0 +1,88 @@
+import bisect
+import os
+from sqlalchemy import Integer, any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from cache import CACHE_TTL, ResponseCache
+from models import Product
+
+# Расчет корзины (POST /quote): цена строки выбирается по количеству товара в заказе -
+# от PRICE_TIER_WHOLESALE_QTY штук оптовая, от PRICE_TIER_BULK_QTY - крупнооптовая.
+PRICE_TIER_WHOLESALE_QTY = int(os.getenv("PRICE_TIER_WHOLESALE_QTY", "10"))
+PRICE_TIER_BULK_QTY = int(os.getenv("PRICE_TIER_BULK_QTY", "100"))
+QUOTE_MAX_ITEMS = 500
+
+# Уровни по возрастанию порога: (порог, название, индекс цены в кортеже цен)
+PRICE_TIERS = sorted([
+    (1, "retail", 0),
+    (PRICE_TIER_WHOLESALE_QTY, "wholesale", 1),
+    (PRICE_TIER_BULK_QTY, "bulk", 2),
+])
+_TIER_THRESHOLDS = [threshold for threshold, _, _ in PRICE_TIERS]
+
+# Отдельный от кэша ответов: цены нужны по одной на товар, и тысячи таких записей
+# вытесняли бы готовые страницы каталога. Ключ ("price", id) -> (retail, wholesale, bulk);
+# сбрасывается по LISTEN/NOTIFY вместе с ("product", id) (notify.py)
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "50000"))
+price_cache = ResponseCache(max_entries=PRICE_CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+
+
+# Только колонки цен, id = ANY(:ids): один план на любое число товаров (IN (...) давал бы
+# отдельный подготовленный запрос на каждую длину списка)
+PRICE_QUERY = select(
+    Product.id, Product.price_retail, Product.price_wholesale, Product.price_bulk
+).where(Product.id == any_(bindparam("ids", type_=ARRAY(Integer))))
+
+
+# Уровень по количеству; если цена уровня не задана - уровень с меньшим порогом
+def unit_price(prices, quantity):
+    tier = bisect.bisect_right(_TIER_THRESHOLDS, quantity) - 1
+    while tier >= 0:
+        _, name, price_index = PRICE_TIERS[tier]
+        if prices[price_index] is not None:
+            return name, prices[price_index]
+        tier -= 1
+    return None, None
+
+
+# lines - [(product_id, quantity)], prices - {product_id: (retail, wholesale, bulk)}.
+# Порог считается по суммарному количеству товара в заказе, даже если он разбит на несколько строк
+def build_quote(lines, prices):
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    items = []
+    errors = []
+    total = 0
+    total_quantity = 0
+    for index, (product_id, quantity) in enumerate(lines):
+        product_prices = prices.get(product_id)
+        if product_prices is None:
+            errors.append({"index": index, "product_id": product_id, "error": "Product not found"})
+            continue
+        tier, price = unit_price(product_prices, quantities[product_id])
+        if price is None:
+            errors.append({"index": index, "product_id": product_id, "error": "Product has no price"})
+            continue
+        line_total = price * quantity
+        items.append({
+            "index": index,
+            "product_id": product_id,
+            "quantity": quantity,
+            "tier": tier,
+            "unit_price": price,
+            "retail_price": product_prices[0],
+            "total": line_total,
+        })
+        total += line_total
+        total_quantity += quantity
+
+    return {
+        "status": "partial" if errors else "ok",
+        "items": items,
+        "quantity": total_quantity,
+        "total": total,
+        "errors": errors,
+        "tiers": {name: threshold for threshold, name, _ in PRICE_TIERS},
+    }
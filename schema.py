@@ -0,0 +1,283 @@
+import hashlib
+from sqlalchemy import DefaultClause, inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+from models import Base
+
+# Канал LISTEN/NOTIFY, в который триггеры пишут изменения контента
+CHANGES_CHANNEL = 'content_changes'
+
+# Таблицы, изменения которых (из API, админки или psql) рассылаются воркерам API
+NOTIFY_TABLES = ['products', 'blog_posts', 'company_info']
+
+NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION notify_content_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        '{CHANGES_CHANNEL}',
+        json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def notify_trigger(table):
+    return f"""
+CREATE OR REPLACE TRIGGER {table}_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE FUNCTION notify_content_change()
+"""
+
+
+# Таблицы, в колонке images которых лежат ссылки на загрузки (/uploads/...)
+IMAGE_REF_TABLES = ['products', 'blog_posts']
+UPLOADS_PREFIX = '/uploads/'
+
+# Элементы JSON-массива images как строки; не-массив (NULL, объект) дает пустой набор
+def _image_paths_sql(images):
+    return (
+        f"SELECT DISTINCT substr(t.path, {len(UPLOADS_PREFIX) + 1}) AS path "
+        f"FROM json_array_elements_text(CASE WHEN json_typeof({images}::json) = 'array' "
+        f"THEN {images}::json ELSE '[]'::json END) AS t(path) "
+        f"WHERE t.path LIKE '{UPLOADS_PREFIX}%'"
+    )
+
+
+# Строки, освобожденные UPDATE/DELETE, попадают в очередь image_orphans: сборщику не нужно
+# обходить весь каталог загрузок, чтобы найти файлы удаленных товаров и постов
+IMAGE_REFS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION sync_image_refs() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        WITH removed AS (
+            DELETE FROM image_refs WHERE table_name = TG_TABLE_NAME AND row_id = OLD.id RETURNING path
+        )
+        INSERT INTO image_orphans (path, released_at)
+        SELECT DISTINCT removed.path, clock_timestamp() at time zone 'utc' FROM removed
+        WHERE TG_OP = 'DELETE' OR removed.path NOT IN ({_image_paths_sql('NEW.images')})
+        ON CONFLICT (path) DO UPDATE SET released_at = EXCLUDED.released_at;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO image_refs (path, table_name, row_id)
+        SELECT refs.path, TG_TABLE_NAME, NEW.id FROM ({_image_paths_sql('NEW.images')}) AS refs
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def image_refs_trigger(table):
+    return f"""
+CREATE OR REPLACE TRIGGER {table}_sync_image_refs
+AFTER INSERT OR UPDATE OF images OR DELETE ON {table}
+FOR EACH ROW EXECUTE FUNCTION sync_image_refs()
+"""
+
+
+# Заполнение индекса по уже существующим строкам (триггеры видят только новые изменения)
+def image_refs_backfill(table):
+    return (
+        "INSERT INTO image_refs (path, table_name, row_id) "
+        f"SELECT refs.path, '{table}', {table}.id FROM {table}, "
+        f"LATERAL ({_image_paths_sql(f'{table}.images')}) AS refs "
+        "ON CONFLICT DO NOTHING"
+    )
+
+
+# Таблицы, о которых достаточно одного уведомления на оператор: пакетная вставка отзывов
+# (журнал write_behind, COPY) не должна порождать по уведомлению на строку
+STATEMENT_NOTIFY_TABLES = ['reviews']
+
+NOTIFY_STATEMENT_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        '{CHANGES_CHANNEL}',
+        json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', NULL)::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def statement_notify_trigger(table):
+    return f"""
+CREATE OR REPLACE TRIGGER {table}_notify_statement
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()
+"""
+
+
+# Счетчик отзывов в review_stats: statement-триггеры считают строки transition-таблицы,
+# так что пакетная вставка или удаление - одно обновление счетчика
+REVIEW_STATS_FUNCTION = """
+CREATE OR REPLACE FUNCTION update_review_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE review_stats SET total = total + (SELECT count(*) FROM changed_rows) WHERE id = 1;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE review_stats SET total = total - (SELECT count(*) FROM changed_rows) WHERE id = 1;
+    ELSE
+        UPDATE review_stats SET total = 0 WHERE id = 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+REVIEW_STATS_TRIGGERS = [
+    """
+CREATE OR REPLACE TRIGGER reviews_stats_insert
+AFTER INSERT ON reviews REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION update_review_stats()
+""",
+    """
+CREATE OR REPLACE TRIGGER reviews_stats_delete
+AFTER DELETE ON reviews REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION update_review_stats()
+""",
+    """
+CREATE OR REPLACE TRIGGER reviews_stats_truncate
+AFTER TRUNCATE ON reviews
+FOR EACH STATEMENT EXECUTE FUNCTION update_review_stats()
+""",
+]
+
+# Пересчет при обновлении схемы: заодно исправляет расхождение, если триггеры когда-то отключали
+REVIEW_STATS_BACKFILL = (
+    "INSERT INTO review_stats (id, total) SELECT 1, count(*) FROM reviews "
+    "ON CONFLICT (id) DO UPDATE SET total = EXCLUDED.total"
+)
+
+
+# create_all не меняет уже существующие таблицы: недостающие колонки добавляем сами
+def add_missing_columns(conn):
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column_ddl}")
+
+
+# server_default, появившиеся у уже существующих колонок (например, reviews.created_at),
+# иначе вставки из psql и сторонних скриптов получают NULL
+def sync_column_defaults(conn):
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.server_default, DefaultClause):
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    default_sql = "'" + default.replace("'", "''") + "'"
+                else:
+                    default_sql = str(default.compile(dialect=conn.dialect))
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET DEFAULT {default_sql}")
+
+
+# Колонки, тип которых поменялся после появления таблицы: (таблица, колонка, новый тип)
+COLUMN_TYPE_MIGRATIONS = [
+    ('products', 'attributes', 'jsonb'),
+]
+
+
+def migrate_column_types(conn):
+    for table, column, new_type in COLUMN_TYPE_MIGRATIONS:
+        current_type = conn.exec_driver_sql(
+            "SELECT data_type FROM information_schema.columns "
+            f"WHERE table_name = '{table}' AND column_name = '{column}'"
+        ).scalar()
+        if current_type is not None and current_type != new_type:
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {new_type} USING {column}::{new_type}"
+            )
+
+
+def create_schema(conn):
+    Base.metadata.create_all(conn)
+    add_missing_columns(conn)
+    sync_column_defaults(conn)
+    migrate_column_types(conn)
+
+    # То же для индексов
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+    conn.exec_driver_sql(NOTIFY_FUNCTION)
+    for table in NOTIFY_TABLES:
+        conn.exec_driver_sql(notify_trigger(table))
+
+    conn.exec_driver_sql(NOTIFY_STATEMENT_FUNCTION)
+    for table in STATEMENT_NOTIFY_TABLES:
+        conn.exec_driver_sql(statement_notify_trigger(table))
+
+    conn.exec_driver_sql(REVIEW_STATS_FUNCTION)
+    for trigger in REVIEW_STATS_TRIGGERS:
+        conn.exec_driver_sql(trigger)
+    conn.exec_driver_sql(REVIEW_STATS_BACKFILL)
+
+    conn.exec_driver_sql(IMAGE_REFS_FUNCTION)
+    for table in IMAGE_REF_TABLES:
+        conn.exec_driver_sql(image_refs_trigger(table))
+        conn.exec_driver_sql(image_refs_backfill(table))
+
+
+# Версия схемы - хеш DDL моделей, триггеров и миграций. Пока он совпадает с записанным
+# в schema_version, старт API обходится одним запросом вместо create_all и inspector
+SCHEMA_VERSION_TABLE = 'schema_version'
+# Ключ advisory lock: при одновременном старте нескольких воркеров схему меняет один
+SCHEMA_LOCK_KEY = 727001
+
+
+def schema_fingerprint(dialect):
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(str(CreateTable(table).compile(dialect=dialect)))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            parts.append(str(CreateIndex(index).compile(dialect=dialect)))
+    parts.append(NOTIFY_FUNCTION)
+    parts.extend(notify_trigger(table) for table in NOTIFY_TABLES)
+    parts.append(NOTIFY_STATEMENT_FUNCTION)
+    parts.extend(statement_notify_trigger(table) for table in STATEMENT_NOTIFY_TABLES)
+    parts.append(REVIEW_STATS_FUNCTION)
+    parts.extend(REVIEW_STATS_TRIGGERS)
+    parts.append(IMAGE_REFS_FUNCTION)
+    parts.extend(image_refs_trigger(table) for table in IMAGE_REF_TABLES)
+    parts.append(repr(COLUMN_TYPE_MIGRATIONS))
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()[:16]
+
+
+def _current_version(conn):
+    if conn.exec_driver_sql(f"SELECT to_regclass('{SCHEMA_VERSION_TABLE}')").scalar() is None:
+        return None
+    return conn.exec_driver_sql(f"SELECT version FROM {SCHEMA_VERSION_TABLE}").scalar()
+
+
+# Вызывается через conn.run_sync(ensure_schema) при старте API; True, если схема обновлялась
+def ensure_schema(conn):
+    version = schema_fingerprint(conn.dialect)
+    if _current_version(conn) == version:
+        return False
+
+    conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK_KEY})")
+    # Пока ждали блокировку, схему мог обновить другой воркер
+    if _current_version(conn) == version:
+        return False
+    create_schema(conn)
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+        "version varchar NOT NULL, "
+        "applied_at timestamp NOT NULL DEFAULT (now() at time zone 'utc'))"
+    )
+    conn.exec_driver_sql(f"DELETE FROM {SCHEMA_VERSION_TABLE}")
+    conn.exec_driver_sql(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version) VALUES ('{version}')")
+    return True
@@ -0,0 +1,76 @@
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, ConfigDict, Field, StrictInt, ValidationError
+from pricing import QUOTE_MAX_ITEMS
+
+# Схемы для пакетной записи JSON (POST /products/batch, POST /blog-posts/batch) и корзины (POST /quote).
+# Каждый элемент массива валидируется отдельно: невалидные попадают в отчет,
+# валидные вставляются одним multi-row INSERT ... RETURNING id.
+
+BATCH_MAX_ITEMS = 1000
+# Колонки цен и id - integer (int4): большее значение уронило бы весь multi-row INSERT
+INT4_MAX = 2_147_483_647
+
+
+class ProductIn(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+    title: str = Field(min_length=1)
+    guarantee: str = ""
+    region: str = ""
+    # Strict: true не превращается в 1 (как и при импорте, catalog_import._parse_price)
+    price_retail: StrictInt = Field(ge=0, le=INT4_MAX)
+    price_wholesale: StrictInt = Field(ge=0, le=INT4_MAX)
+    price_bulk: StrictInt = Field(ge=0, le=INT4_MAX)
+    description: str = ""
+    attributes: Dict[str, Any] = Field(default_factory=dict)
+    images: List[str] = Field(default_factory=list)
+
+
+class BlogPostIn(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+    title: str = Field(min_length=1)
+    content: str = Field(min_length=1)
+    images: List[str] = Field(default_factory=list)
+
+
+def _error_details(error):
+    return [
+        {"loc": list(item["loc"]), "msg": item["msg"]}
+        for item in error.errors(include_url=False)
+    ]
+
+
+# Валидация массива: (строки для INSERT, индексы этих строк во входном массиве, ошибки)
+def validate_batch(schema, items):
+    rows = []
+    indexes = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            rows.append(schema.model_validate(item).model_dump())
+        except ValidationError as e:
+            errors.append({"index": index, "errors": _error_details(e)})
+            continue
+        indexes.append(index)
+    return rows, indexes, errors
+
+
+def batch_items(payload) -> Optional[list]:
+    if isinstance(payload, dict):
+        payload = payload.get("items")
+    return payload if isinstance(payload, list) else None
+
+
+# POST /quote: строки корзины
+class QuoteLine(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    product_id: int = Field(ge=1, le=INT4_MAX)
+    quantity: int = Field(ge=1, le=1_000_000)
+
+
+class QuoteIn(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    items: List[QuoteLine] = Field(min_length=1, max_length=QUOTE_MAX_ITEMS)
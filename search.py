@@ -0,0 +1,30 @@
+from sqlalchemy import func, literal, select, union_all
+from models import BlogPost, Product, SEARCH_CONFIG
+
+SEARCH_TYPES = ('products', 'blog_posts')
+
+
+# Ранжированный поиск по products и blog_posts через GIN-индексы на search_vector
+def build_search_query(q, types=SEARCH_TYPES, limit=20):
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    selects = []
+    if 'products' in types:
+        selects.append(
+            select(
+                literal('product').label('type'),
+                Product.id,
+                Product.title,
+                func.ts_rank(Product.search_vector, query).label('rank'),
+            ).where(Product.search_vector.op('@@')(query))
+        )
+    if 'blog_posts' in types:
+        selects.append(
+            select(
+                literal('blog_post').label('type'),
+                BlogPost.id,
+                BlogPost.title,
+                func.ts_rank(BlogPost.search_vector, query).label('rank'),
+            ).where(BlogPost.search_vector.op('@@')(query))
+        )
+    combined = (union_all(*selects) if len(selects) > 1 else selects[0]).subquery()
+    return select(combined).order_by(combined.c.rank.desc(), combined.c.id).limit(limit)
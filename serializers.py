@@ -0,0 +1,41 @@
+import orjson
+from fastapi.responses import Response
+from sqlalchemy import select
+from models import BlogPost, CompanyInfo, Product, Request, Review
+
+
+# Тело уже сериализовано в bytes: FastAPI не прогоняет его через jsonable_encoder
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+
+def dumps(data):
+    return orjson.dumps(data)
+
+
+# Сериализатор строк запроса: SELECT только нужных колонок -> кортежи -> dict -> orjson,
+# без создания ORM-объектов
+class RowSerializer:
+    def __init__(self, model, fields):
+        self.fields = tuple(fields)
+        self.columns = [getattr(model, field) for field in self.fields]
+
+    def select(self):
+        return select(*self.columns)
+
+    def item(self, row):
+        return dict(zip(self.fields, row))
+
+    def items(self, rows):
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+
+company_info_serializer = RowSerializer(CompanyInfo, ("phone", "email", "address", "social_links"))
+product_serializer = RowSerializer(Product, (
+    "id", "title", "attributes", "guarantee", "region",
+    "price_retail", "price_wholesale", "price_bulk", "description", "images",
+))
+blog_post_serializer = RowSerializer(BlogPost, ("id", "title", "content", "images"))
+request_serializer = RowSerializer(Request, ("id", "name", "phone", "comment"))
+review_serializer = RowSerializer(Review, ("id", "name", "review", "created_at"))
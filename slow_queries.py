@@ -0,0 +1,287 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Журнал медленных запросов для API (SQLAlchemy, main.py) и админки (Django, admin_app/middleware.py).
+# Запросы дольше порога пишутся в ротируемый лог (JSON на строку) и в таблицу top-N
+# в памяти, сгруппированную по нормализованному тексту запроса. Для самых медленных
+# SELECT можно снять EXPLAIN (ANALYZE, BUFFERS) - в фоне, отдельным соединением.
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1"
+SLOW_QUERY_EXPLAIN_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_EXPLAIN_THRESHOLD_MS", "1000"))
+# Повторный EXPLAIN одного и того же запроса не чаще раза в указанное число секунд
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+SLOW_QUERY_TOP_N = int(os.getenv("SLOW_QUERY_TOP_N", "50"))
+SLOW_QUERY_LOG_DIR = os.getenv(
+    "SLOW_QUERY_LOG_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs"),
+)
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+
+MAX_PARAMETERS = 20
+MAX_PARAMETER_CHARS = 200
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+# :name - плейсхолдер, но не приведение типа ::jsonb
+_PLACEHOLDER_RE = re.compile(r"\$\d+|%\(\w+\)s|%s|(?<![:\w]):\w+")
+_CAST_RE = re.compile(r"\?::\w+(?:\[\])?")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST_RE = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+# Текст запроса без значений: литералы и плейсхолдеры -> ?, списки (?, ?, ...) -> (...)
+def normalize(statement):
+    text = _STRING_RE.sub("?", statement)
+    text = _PLACEHOLDER_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _CAST_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("(...)", text)
+    text = _VALUES_LIST_RE.sub(r"\1", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _short(value):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= MAX_PARAMETER_CHARS else text[:MAX_PARAMETER_CHARS] + "..."
+
+
+def format_parameters(parameters):
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        items = list(parameters.items())[:MAX_PARAMETERS]
+        return {key: _short(value) for key, value in items}
+    if isinstance(parameters, (list, tuple)):
+        return [_short(value) for value in list(parameters)[:MAX_PARAMETERS]]
+    return _short(parameters)
+
+
+def is_explainable(statement):
+    head = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return head == "SELECT"
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        name,
+        threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+        explain=SLOW_QUERY_EXPLAIN,
+        explain_threshold_ms=SLOW_QUERY_EXPLAIN_THRESHOLD_MS,
+        top_n=SLOW_QUERY_TOP_N,
+        log_dir=SLOW_QUERY_LOG_DIR,
+    ):
+        self.name = name
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.explain_threshold = explain_threshold_ms / 1000
+        self.top_n = top_n
+        self.log_path = os.path.join(log_dir, f"slow_queries_{name}.log")
+        self._logger = None
+        self._listener = None
+        # Django выполняет запросы из нескольких потоков
+        self._lock = threading.Lock()
+        self._top = {}            # нормализованный запрос -> агрегат
+        self._explained_at = {}   # нормализованный запрос -> время последнего EXPLAIN
+        self.recorded = 0
+
+    # record() вызывается из after_cursor_execute, то есть в event loop API: запись в файл
+    # и ротацию выполняет поток QueueListener, а логгер только кладет записи в очередь
+    def _get_logger(self):
+        if self._logger is None:
+            with self._lock:
+                if self._logger is None:
+                    os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                    handler = RotatingFileHandler(
+                        self.log_path, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS
+                    )
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    records = queue.SimpleQueue()
+                    self._listener = QueueListener(records, handler)
+                    self._listener.start()
+                    # При выходе дописываем то, что осталось в очереди
+                    atexit.register(self.close)
+                    logger = logging.getLogger(f"slow_queries.{self.name}")
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                    logger.addHandler(QueueHandler(records))
+                    self._logger = logger
+        return self._logger
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _write(self, entry):
+        self._get_logger().info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    # Возвращает нормализованный текст, если запрос стоит отправить на EXPLAIN, иначе None
+    def record(self, statement, parameters, duration, source=None):
+        if duration < self.threshold or statement.lstrip()[:7].upper() == "EXPLAIN":
+            return None
+        normalized = normalize(statement)
+        parameters = format_parameters(parameters)
+        self._write({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "duration_ms": round(duration * 1000, 2),
+            "source": source,
+            "normalized": normalized,
+            "statement": statement,
+            "parameters": parameters,
+        })
+
+        with self._lock:
+            self.recorded += 1
+            entry = self._top.get(normalized)
+            if entry is None:
+                entry = self._top[normalized] = {
+                    "normalized": normalized,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "last_source": None,
+                    "last_parameters": None,
+                    "explain": None,
+                }
+            duration_ms = duration * 1000
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            if duration_ms >= entry["max_ms"]:
+                entry["max_ms"] = duration_ms
+                entry["last_source"] = source
+                entry["last_parameters"] = parameters
+            if len(self._top) > self.top_n * 2:
+                self._prune()
+
+            if not (self.explain and duration >= self.explain_threshold and is_explainable(statement)):
+                return None
+            now = time.monotonic()
+            explained_at = self._explained_at.get(normalized)
+            if explained_at is not None and now - explained_at < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return None
+            self._explained_at[normalized] = now
+        return normalized
+
+    def _prune(self):
+        keep = sorted(self._top.values(), key=lambda entry: entry["total_ms"], reverse=True)[:self.top_n]
+        self._top = {entry["normalized"]: entry for entry in keep}
+
+    def set_explain(self, normalized, plan):
+        with self._lock:
+            entry = self._top.get(normalized)
+            if entry is not None:
+                entry["explain"] = plan
+        self._write({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "normalized": normalized,
+            "explain": plan,
+        })
+
+    def top(self, limit=None):
+        with self._lock:
+            entries = sorted(self._top.values(), key=lambda entry: entry["total_ms"], reverse=True)
+            entries = [dict(entry) for entry in entries[:limit or self.top_n]]
+        for entry in entries:
+            entry["mean_ms"] = entry["total_ms"] / entry["count"]
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "explain": self.explain,
+            "recorded": self.recorded,
+            "log": self.log_path,
+            "queries": entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._top.clear()
+            self._explained_at.clear()
+            self.recorded = 0
+
+
+# --- API (SQLAlchemy) ---
+# Источник запроса: "GET /products (get_products)"; None для фоновых задач
+_query_source = contextvars.ContextVar("query_source", default=None)
+
+api_slow_query_log = SlowQueryLog("api")
+
+
+class QuerySourceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        # Обработчик станет известен только после роутинга - храним сам scope
+        token = _query_source.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _query_source.reset(token)
+
+
+def _source():
+    scope = _query_source.get()
+    if scope is None:
+        return None
+    endpoint = scope.get("endpoint")
+    name = getattr(endpoint, "__name__", None)
+    source = f"{scope['method']} {scope['path']}"
+    return f"{source} ({name})" if name else source
+
+
+def install_sqlalchemy_hooks(slow_log, get_engine):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    explain_tasks = set()
+
+    async def explain(normalized, statement, parameters):
+        try:
+            # connect() без commit: транзакция с EXPLAIN ANALYZE откатывается
+            async with get_engine().connect() as conn:
+                result = await conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                plan = "\n".join(row[0] for row in result)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+        slow_log.set_explain(normalized, plan)
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["slow_query_started"].pop()
+        if duration < slow_log.threshold:
+            return
+        normalized = slow_log.record(statement, parameters, duration, _source())
+        if normalized is None or executemany or explain_tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # Пустой контекст: фоновый EXPLAIN не должен считаться запросом текущего HTTP-запроса
+        task = loop.create_task(explain(normalized, statement, parameters), context=contextvars.Context())
+        explain_tasks.add(task)
+        task.add_done_callback(explain_tasks.discard)
+
+    @event.listens_for(Engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None:
+            started = context.connection.info.get("slow_query_started")
+            if started:
+                started.pop()
@@ -0,0 +1,165 @@
+import calendar
+import os
+import re
+from email.utils import parsedate
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from storage import is_content_addressed
+
+# Файлы с хэшем в имени никогда не меняются - их можно кэшировать "навсегда"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = os.getenv("UPLOADS_CACHE_CONTROL", "public, max-age=3600")
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def strong_etag(relative_path, stat_result):
+    if is_content_addressed(relative_path):
+        # sha256 содержимого уже есть в имени файла
+        return '"%s"' % os.path.splitext(os.path.basename(relative_path))[0]
+    return '"%x-%x"' % (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def etag_matches(header_value, etag):
+    if header_value.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header_value.split(",")]
+    return etag in tags or "W/" + etag in tags
+
+
+# If-Modified-Since учитывается, только если нет If-None-Match (RFC 9110, 13.1.3)
+def not_modified_since(header_value, mtime):
+    parsed = parsedate(header_value)
+    if parsed is None:
+        return False
+    return calendar.timegm(parsed) >= int(mtime)
+
+
+# (start, end), "unsatisfiable" или None - заголовок игнорируется и файл отдается целиком:
+# так RFC 9110 требует поступать с синтаксически неверным Range (например, bytes=5-2)
+def parse_range(header_value, size):
+    # Поддерживается один диапазон; для multipart/byteranges отдаем файл целиком (это допустимо по RFC 9110)
+    match = _RANGE_RE.match(header_value.replace(" ", ""))
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = min(int(end), size)
+        return (size - length, size - 1) if length else "unsatisfiable"
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+class UploadFileResponse(FileResponse):
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, stat_result, headers, method, byte_range=None, status_code=200):
+        super().__init__(path, status_code=status_code, headers=headers, stat_result=stat_result, method=method)
+        self.offset = 0
+        self.count = stat_result.st_size
+        self.headers["accept-ranges"] = "bytes"
+        if byte_range == "unsatisfiable":
+            self.status_code = 416
+            self.count = 0
+            self.headers["content-range"] = f"bytes */{stat_result.st_size}"
+            self.headers["content-length"] = "0"
+        elif byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset = start
+            self.count = end - start + 1
+            self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+            self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            # Сервер умеет sendfile: отдаем дескриптор, байты не проходят через Python
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# StaticFiles для /uploads: сильные ETag, 304 на If-None-Match, Range-запросы
+# и Cache-Control: immutable для файлов с хэшем содержимого в имени
+class UploadStaticFiles(StaticFiles):
+    async def get_response(self, path, scope):
+        # Служебные каталоги (.tmp, карантин GC и т.п.) наружу не отдаются
+        if any(part.startswith(".") for part in path.replace(os.sep, "/").split("/")):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        relative_path = os.path.relpath(full_path, os.path.realpath(self.directory))
+        etag = strong_etag(relative_path, stat_result)
+        headers = {
+            "etag": etag,
+            "cache-control": IMMUTABLE_CACHE_CONTROL if is_content_addressed(relative_path) else MUTABLE_CACHE_CONTROL,
+        }
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+        else:
+            if_modified_since = request_headers.get("if-modified-since")
+            if if_modified_since is not None and not_modified_since(if_modified_since, stat_result.st_mtime):
+                return Response(status_code=304, headers=headers)
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if range_header is not None and status_code == 200:
+            # If-Range: диапазон отдаем только если файл не изменился
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range.strip() == etag:
+                byte_range = parse_range(range_header, stat_result.st_size)
+
+        return UploadFileResponse(
+            full_path,
+            stat_result=stat_result,
+            headers=headers,
+            method=scope["method"],
+            byte_range=byte_range,
+            status_code=status_code,
+        )
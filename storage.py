@@ -0,0 +1,88 @@
+import hashlib
+import os
+import re
+import tempfile
+
+# Общее хранилище загрузок для API (main.py) и админки (admin_app/admin.py).
+# Файлы хранятся один раз под sha256 содержимого: uploads/ab/abcdef...png
+UPLOAD_DIR = os.getenv(
+    "UPLOAD_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"),
+)
+UPLOAD_URL = "/uploads/"
+TMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+
+_EXTENSION_RE = re.compile(r"^\.[a-z0-9]{1,8}$")
+_HASHED_PATH_RE = re.compile(r"^([0-9a-f]{2})/\1[0-9a-f]{62}(\.[a-z0-9]{1,8})?$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if _EXTENSION_RE.match(ext) else ""
+
+
+def hashed_path(digest, filename):
+    return os.path.join(digest[:2], digest + _extension(filename))
+
+
+# Путь относительно UPLOAD_DIR вида ab/ab....png (содержимое такого файла неизменно)
+def is_content_addressed(relative_path):
+    return _HASHED_PATH_RE.match(relative_path.replace(os.sep, "/")) is not None
+
+
+# Запись загрузки во временный файл с подсчетом sha256 и размера по ходу записи;
+# commit() переносит файл на место по хэшу содержимого.
+# Блокирующие методы: из async-кода вызывать через run_in_threadpool.
+class UploadWriter:
+    def __init__(self, max_size=MAX_UPLOAD_SIZE):
+        os.makedirs(TMP_DIR, exist_ok=True)
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=TMP_DIR)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise UploadTooLarge(f"File is larger than {self.max_size} bytes")
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self, filename):
+        self._file.close()
+        relative_path = hashed_path(self._digest.hexdigest(), filename)
+        final_path = os.path.join(UPLOAD_DIR, relative_path)
+        if os.path.exists(final_path):
+            # Такой файл уже загружен - второй экземпляр не нужен. mtime обновляем:
+            # по нему image_gc.py отсчитывает льготный срок для еще не сохраненных ссылок
+            os.remove(self._tmp_path)
+            os.utime(final_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.chmod(self._tmp_path, 0o644)
+            os.replace(self._tmp_path, final_path)
+        return UPLOAD_URL + relative_path.replace(os.sep, "/")
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def save_chunks(chunks, filename, max_size=MAX_UPLOAD_SIZE):
+    writer = UploadWriter(max_size)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer.commit(filename)
+    except BaseException:
+        writer.abort()
+        raise
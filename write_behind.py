@@ -0,0 +1,323 @@
+import asyncio
+import datetime
+import fcntl
+import logging
+import os
+import time
+import orjson
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError, ProgrammingError
+from database import SessionLocal
+from models import Request, Review
+
+logger = logging.getLogger(__name__)
+
+# Режим отложенной записи заявок и отзывов (WRITE_BEHIND=1).
+# Заявка дописывается в локальный журнал и подтверждается клиенту после fsync журнала,
+# а в Postgres попадает пачкой (multi-row INSERT) по размеру или по таймеру.
+# Журнал состоит из сегментов <pid>-<time_ns>.log; активный сегмент воркер держит под flock,
+# поэтому при старте можно безопасно дозаписать в БД сегменты завершившихся процессов.
+# Гарантия at-least-once: если процесс упадет между COMMIT и удалением сегмента,
+# пачка будет записана повторно при следующем старте.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_DIR = os.getenv(
+    "WRITE_BEHIND_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal"),
+)
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+# group - ответ после fsync, один fsync на все записи, накопившиеся за время предыдущего
+#         (group commit);
+# always - fsync после каждой записи прямо в event loop;
+# batch - ответ до fsync, один fsync на пачку перед INSERT: быстрее всего, но подтвержденные
+#         заявки теряются при падении машины - только если это допустимо
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "group")
+
+# Сегмент, который не удается записать столько раз подряд (или сразу - при ошибке данных,
+# которую повтор не исправит), переименовывается в *.failed и больше не задерживает
+# следующие сегменты. Файл остается в каталоге журнала для разбора вручную
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "10"))
+
+TABLE_MODELS = {"requests": Request, "reviews": Review}
+
+
+# SQLSTATE классов 22 (ошибка данных), 23 (нарушение ограничения), 42 (ошибка в запросе)
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+
+
+# Ошибки содержимого пачки (нарушение ограничения, переполнение, битая запись журнала),
+# в отличие от недоступности БД. asyncpg под SQLAlchemy приходит как общий DBAPIError,
+# поэтому смотрим и на SQLSTATE
+def _is_permanent(error):
+    if isinstance(error, (DataError, IntegrityError, ProgrammingError, KeyError, TypeError, ValueError)):
+        return True
+    sqlstate = getattr(getattr(error, "orig", None), "sqlstate", None)
+    return bool(sqlstate) and sqlstate[:2] in PERMANENT_SQLSTATE_CLASSES
+
+
+def _decode_row(row):
+    row = dict(row)
+    if row.get("created_at"):
+        row["created_at"] = datetime.datetime.fromisoformat(row["created_at"])
+    return row
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        directory=WRITE_BEHIND_DIR,
+        batch_size=WRITE_BEHIND_BATCH_SIZE,
+        flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+        fsync=WRITE_BEHIND_FSYNC,
+        max_attempts=WRITE_BEHIND_MAX_ATTEMPTS,
+    ):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self._attempts = 0   # неудачные попытки записать первый сегмент в _sealed
+        self._pending = []   # [(table, row, время постановки)] - содержимое активного сегмента
+        self._segment = None  # (path, fd) активного сегмента
+        self._sealed = []    # [(path, fd, entries)] - закрытые сегменты, ждущие INSERT
+        self._wakeup = None
+        self._flush_lock = None
+        self._task = None
+        # Group commit: номер последней записи в журнал и последней записи, покрытой fsync
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._unsynced_fds = set()
+        self._syncing = None  # future текущего fsync
+        self.submitted = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.replayed = 0
+        self.failed_segments = 0
+        self.failed_rows = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        await self.replay()
+        self._open_segment()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        while self._syncing is not None:
+            await asyncio.shield(self._syncing)
+        if self._segment is not None:
+            path, fd = self._segment
+            self._segment = None
+            self._unsynced_fds.discard(fd)
+            # Пустой сегмент не нужен; непустой (БД недоступна) останется для replay
+            if not self._pending:
+                os.unlink(path)
+            os.close(fd)
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{os.getpid()}-{time.time_ns()}.log")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._segment = (path, fd)
+
+    async def submit(self, table, row):
+        row = dict(row, created_at=datetime.datetime.utcnow().isoformat())
+        _, fd = self._segment
+        os.write(fd, orjson.dumps({"table": table, "row": row}) + b"\n")
+        if self.fsync == "always":
+            os.fsync(fd)
+        self._pending.append((table, row, time.monotonic()))
+        self.submitted += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        if self.fsync == "group":
+            self._written_seq += 1
+            self._unsynced_fds.add(fd)
+            await self._group_sync(self._written_seq)
+
+    # Первый ожидающий делает fsync за всех, кто записал до его начала; записавшие во время
+    # fsync ждут его окончания и делают следующий
+    async def _group_sync(self, seq):
+        loop = asyncio.get_running_loop()
+        while self._synced_seq < seq:
+            if self._syncing is not None:
+                await asyncio.shield(self._syncing)
+                continue
+            self._syncing = loop.create_future()
+            target = self._written_seq
+            fds = self._unsynced_fds
+            self._unsynced_fds = set()
+            try:
+                for fd in fds:
+                    await loop.run_in_executor(None, os.fsync, fd)
+                self._synced_seq = target
+            except BaseException:
+                self._unsynced_fds |= fds
+                raise
+            finally:
+                syncing = self._syncing
+                self._syncing = None
+                syncing.set_result(None)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._pending:
+                path, fd = self._segment
+                entries = self._pending
+                self._pending = []
+                self._open_segment()
+                self._sealed.append((path, fd, entries))
+
+            loop = asyncio.get_running_loop()
+            while self._sealed:
+                path, fd, entries = self._sealed[0]
+                started = time.perf_counter()
+                try:
+                    if self.fsync != "always":
+                        await loop.run_in_executor(None, os.fsync, fd)
+                    await self._insert([(table, row) for table, row, _ in entries])
+                except Exception as e:
+                    self.failures += 1
+                    self._attempts += 1
+                    if not _is_permanent(e) and self._attempts < self.max_attempts:
+                        # Сегмент остается на диске, попробуем на следующем цикле
+                        logger.warning("Write-behind flush failed: %s", e)
+                        return
+                    await self._release(fd)
+                    self._move_aside(path, len(entries), self._attempts, e)
+                    self._sealed.pop(0)
+                    self._attempts = 0
+                    continue
+                await self._release(fd)
+                os.unlink(path)
+                os.close(fd)
+                self._sealed.pop(0)
+                self._attempts = 0
+                self.flushed += len(entries)
+                self.batches += 1
+                self.last_flush_seconds = time.perf_counter() - started
+
+    # Дескриптор может быть в очереди group commit: fsync в пуле потоков
+    # не должен попасть на закрытый (или уже переиспользованный) fd
+    async def _release(self, fd):
+        while self._syncing is not None:
+            await asyncio.shield(self._syncing)
+        self._unsynced_fds.discard(fd)
+
+    def _move_aside(self, path, rows, attempts, error):
+        failed_path = path[:-len(".log")] + ".failed"
+        os.rename(path, failed_path)
+        self.failed_segments += 1
+        self.failed_rows += rows
+        logger.error(
+            "Write-behind segment with %d rows failed %d time(s), moved to %s: %s",
+            rows, attempts, failed_path, error,
+        )
+
+    async def _insert(self, entries):
+        rows_by_table = {}
+        for table, row in entries:
+            rows_by_table.setdefault(table, []).append(_decode_row(row))
+        async with SessionLocal() as session:
+            for table, rows in rows_by_table.items():
+                # executemany SQLAlchemy 2.0 превращается в multi-row INSERT (insertmanyvalues)
+                await session.execute(insert(TABLE_MODELS[table]), rows)
+            await session.commit()
+
+    # Дозапись сегментов, оставшихся от упавших или остановленных процессов
+    async def replay(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".log"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                # Другой воркер уже дозаписал и удалил сегмент после listdir
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Сегмент принадлежит работающему воркеру
+                os.close(fd)
+                continue
+            if os.fstat(fd).st_nlink == 0:
+                # Открыли до unlink, блокировку получили после: сегмент уже дозаписан
+                os.close(fd)
+                continue
+            rows = 0
+            try:
+                batch = []
+                with os.fdopen(os.dup(fd), "rb") as journal:
+                    for line in journal:
+                        try:
+                            entry = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            # Оборванная последняя строка после падения процесса
+                            continue
+                        batch.append((entry["table"], entry["row"]))
+                        rows += 1
+                        if len(batch) >= self.batch_size:
+                            await self._insert(batch)
+                            self.replayed += len(batch)
+                            batch = []
+                if batch:
+                    await self._insert(batch)
+                    self.replayed += len(batch)
+                os.unlink(path)
+            except Exception as e:
+                # Ошибка данных не должна останавливать старт воркера; пачки до нее уже записаны
+                if not _is_permanent(e):
+                    raise
+                self._move_aside(path, rows, 1, e)
+            finally:
+                os.close(fd)
+
+    def stats(self):
+        now = time.monotonic()
+        oldest = None
+        if self._sealed:
+            oldest = self._sealed[0][2][0][2]
+        elif self._pending:
+            oldest = self._pending[0][2]
+        return {
+            "enabled": self.running,
+            "pending": len(self._pending) + sum(len(entries) for _, _, entries in self._sealed),
+            "submitted": self.submitted,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "replayed": self.replayed,
+            "failed_segments": self.failed_segments,
+            "failed_rows": self.failed_rows,
+            "flush_lag_seconds": now - oldest if oldest is not None else 0.0,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+write_behind = WriteBehindBuffer()